@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+import re
+import timeit
+
+from measure_slot_error_rate import Evaluator, read_json
+
+def find_kids_negation_regex(sys_line, negation_max_word_distance):
+    """The original cascade of regexes, used as the baseline for the benchmark"""
+    def regex_match(regex):
+        matches = re.search(regex, sys_line, re.IGNORECASE)
+        return matches.group(1) if matches else False
+
+    negation_max_word_distance = str(negation_max_word_distance)
+    match = regex_match(r"\b(ne\w*) (?:\w+ ){0,"+negation_max_word_distance+r"}dět\w*")
+    if not match:
+        match = regex_match(r"dět\w* (?!a )(?:\w+ ){0,2}(ne\w+)")
+    if not match:
+        match = regex_match(r"(zakáz\w*|zákaz\w*) (?:\w+ ){0,"+negation_max_word_distance+r"}dět\w*")
+    if not match:
+        match = regex_match(r"dět\w* (?:\w+ ){0,"+negation_max_word_distance+r"}(zakáz\w*|zákaz\w*)")
+    if not match:
+        match = regex_match(r"(bez) (?:\w+ ){0,3}dět\w*")
+    return match
+
+def main():
+    ap = ArgumentParser(description='Micro-benchmark of the kids_allowed negation detection on the reference texts')
+    ap.add_argument('-s', '--surface_forms_file', type=str, default='surface_forms.json',
+                    help='JSON file containing the surface forms for all slot values.')
+    ap.add_argument('ref_files', type=str, nargs='*', default=['train.json', 'devel.json', 'test.json'],
+                    help='JSON files with the references (default: train, devel and test set).')
+    ap.add_argument('-r', '--repeat', type=int, default=5, help='number of timing repetitions, the best one is reported')
+    args = ap.parse_args()
+
+    ser = Evaluator(read_json(args.surface_forms_file))
+    for ref_file in args.ref_files:
+        ref = read_json(ref_file)
+        subsets = [
+            ("all", [row["text"] for row in ref]),
+            ("kids_allowed", [row["text"] for row in ref if "kids_allowed" in row["da"]]),
+        ]
+        for subset, texts in subsets:
+            for distance in (3, 5):
+                for text in texts:
+                    expected = find_kids_negation_regex(text, distance)
+                    found = ser.find_kids_negation(text, distance)
+                    assert found == expected, f"Mismatch for '{text}' (distance {distance}): {found} != {expected}"
+
+                regex_time = min(timeit.repeat(lambda: [find_kids_negation_regex(text, distance) for text in texts],
+                                               number=1, repeat=args.repeat))
+                scanner_time = min(timeit.repeat(lambda: [ser.find_kids_negation(text, distance) for text in texts],
+                                                 number=1, repeat=args.repeat))
+                print(f"{ref_file} {subset} (distance {distance}, {len(texts)} sentences): "
+                      f"regex {regex_time * 1000:.2f} ms, scanner {scanner_time * 1000:.2f} ms, "
+                      f"speedup {regex_time / scanner_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
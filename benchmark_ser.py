@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import subprocess
+import sys as system
+import tempfile
+import timeit
+
+from measure_slot_error_rate import ErrorSink, Evaluator, parse_da, read_json
+
+# (Total, Missing, Additional) slot errors of the original data sets, with the references used as the system
+# output ("ref") and with the references shifted by one line ("shift"); the replicated corpora have N times more
+GOLDEN_ERRORS = {
+    ("train.json", "ref"): (33, 15, 18),
+    ("train.json", "shift"): (8498, 4514, 3984),
+    ("devel.json", "ref"): (19, 8, 11),
+    ("devel.json", "shift"): (2822, 1570, 1252),
+    ("test.json", "ref"): (13, 5, 8),
+    ("test.json", "shift"): (2578, 1602, 976),
+}
+
+GOLDEN_SER = {
+    ("train.json", "ref"): 0.0056681552731020265,
+    ("train.json", "shift"): 1.4596358639642735,
+    ("devel.json", "ref"): 0.0101931330472103,
+    ("devel.json", "shift"): 1.5139484978540771,
+    ("test.json", "ref"): 0.0064773293472845045,
+    ("test.json", "shift"): 1.284504235176881,
+}
+
+def system_outputs(texts):
+    """The system outputs used for the benchmark: the references themselves (few errors)
+    and the references shifted by one line (a lot of errors)"""
+    return {
+        "ref": texts,
+        "shift": texts[1:] + texts[:1],
+    }
+
+def best_time(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+def check_golden(ref_file, system, scale, result):
+    """Checks that the result matches the golden values, scaled for the replicated corpora"""
+    ser_score, slot_errors, num_missing, num_additional = result
+    expected_errors = tuple(count * scale for count in GOLDEN_ERRORS[ref_file, system])
+    assert (slot_errors, num_missing, num_additional) == expected_errors, \
+        f"{ref_file} {system} x{scale}: errors {(slot_errors, num_missing, num_additional)} != {expected_errors}"
+    assert ser_score == GOLDEN_SER[ref_file, system], \
+        f"{ref_file} {system} x{scale}: SER {ser_score} != {GOLDEN_SER[ref_file, system]}"
+
+def run_cli(surface_forms_file, das, sys, jobs, dedup):
+    """Runs the evaluation script on the given data through temporary files and returns the result"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ref_file = os.path.join(tmp_dir, "ref.json")
+        sys_file = os.path.join(tmp_dir, "sys.txt")
+        with open(ref_file, "w", encoding="utf-8") as fh:
+            json.dump([{"da": da, "text": ""} for da in das], fh, ensure_ascii=False)
+        with open(sys_file, "w", encoding="utf-8") as fh:
+            fh.write("\n".join(sys) + "\n")
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "measure_slot_error_rate.py")
+        command = [system.executable, script, surface_forms_file, ref_file, "--sys_file", sys_file, "-j", str(jobs), "--no_server"]
+        if not dedup:
+            command.append("--no_dedup")
+        elapsed = -timeit.default_timer()
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        elapsed += timeit.default_timer()
+
+    lines = dict(line.split(":", 1) for line in output.splitlines())
+    result = (float(lines["SER"]), int(lines["Total Slot Errors"]),
+              int(lines["Missing Slot Errors"]), int(lines["Additional Slot Errors"]))
+    return elapsed, result
+
+def main():
+    ap = ArgumentParser(description='Benchmark of the Slot Error Rate evaluation on the data sets and their replicated versions')
+    ap.add_argument('-s', '--surface_forms_file', type=str, default='surface_forms.json',
+                    help='JSON file containing the surface forms for all slot values.')
+    ap.add_argument('ref_files', type=str, nargs='*', default=['train.json', 'devel.json', 'test.json'],
+                    help='JSON files with the references (default: train, devel and test set).')
+    ap.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                    help='replicate each data set this many times (default: 1, 10 and 100)')
+    ap.add_argument('-r', '--repeat', type=int, default=3, help='number of timing repetitions, the best one is reported')
+    ap.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used by the evaluation')
+    ap.add_argument('--dedup', action='store_true', help='evaluate repeated identical (DA, output) pairs only once; '+
+                    'off by default, so that the replicated corpora measure the evaluation of all the instances')
+    ap.add_argument('--no_cli', action='store_true', help='do not run the end to end benchmark of the command line script')
+    ap.add_argument('-o', '--output', type=str, help='write the results to this JSON file')
+    args = ap.parse_args()
+
+    surface_forms = read_json(args.surface_forms_file)
+    records = []
+
+    def record(benchmark, ref_file, scale, seconds, num_das, system=None, ser_score=None):
+        records.append({
+            "benchmark": benchmark, "ref_file": ref_file, "scale": scale, "system": system,
+            "num_das": num_das, "seconds": seconds, "ser": ser_score,
+        })
+        print(f"{benchmark:<10} {ref_file:<12} x{scale:<4} {system or '':<6} {num_das:>8} DAs  "
+              f"{seconds * 1000:>10.2f} ms" + (f"  SER {ser_score}" if ser_score is not None else ""))
+
+    init_time = best_time(lambda: Evaluator(surface_forms, ErrorSink()), args.repeat)
+    record("init", args.surface_forms_file, 1, init_time, 0)
+    ser = Evaluator(surface_forms, ErrorSink(), deduplicate=args.dedup)
+
+    for ref_file in args.ref_files:
+        ref = read_json(ref_file)
+        golden = os.path.basename(ref_file)
+        for scale in args.scales:
+            das = [row["da"] for row in ref] * scale
+            texts = [row["text"] for row in ref]
+
+            record("parse_da", golden, scale, best_time(lambda: [parse_da(da) for da in das], args.repeat), len(das))
+
+            for system, sys in system_outputs(texts).items():
+                sys = sys * scale
+                result = ser.evaluate(das, sys, args.jobs)
+                if (golden, system) in GOLDEN_ERRORS:
+                    check_golden(golden, system, scale, result)
+                evaluate_time = best_time(lambda: ser.evaluate(das, sys, args.jobs), args.repeat)
+                record("evaluate", golden, scale, evaluate_time, len(das), system, result[0])
+
+                if not args.no_cli:
+                    cli_time, cli_result = min(run_cli(args.surface_forms_file, das, sys, args.jobs, args.dedup) for _ in range(args.repeat))
+                    assert cli_result == result, f"{golden} {system} x{scale}: CLI result {cli_result} != {result}"
+                    record("cli", golden, scale, cli_time, len(das), system, cli_result[0])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "jobs": args.jobs,
+                "dedup": args.dedup,
+                "repeat": args.repeat,
+                "results": records,
+            }, fh, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,7 @@ import codecs
 import re
 from argparse import ArgumentParser
 
-from itertools import product
-from util import Analyzer, trunc_lemma, load_dais, load_texts, write_toks, DAI
+from util import Analyzer, analyze_texts, trunc_lemma, load_dais, load_texts, write_toks, DAI
 import sys
 import json
 
@@ -26,28 +25,84 @@ def sublist_pos(needle, haystack):
     return -1
 
 
+class NgramIndex(object):
+    """Index of all n-grams of a token sequence (up to the given length), which gives the
+    positions of each n-gram in a single hash lookup. The index is reset for each sentence,
+    so that one instance is reused."""
+
+    def __init__(self, max_len):
+        self.max_len = max_len
+        self.toks = []
+        self.positions = {}
+
+    def reset(self, toks):
+        """Index a new token sequence, replacing the previous one."""
+        self.toks = toks
+        self.positions.clear()
+        positions = self.positions
+        num_toks = len(toks)
+        for pos in xrange(num_toks):
+            for end in xrange(pos + 1, min(pos + self.max_len, num_toks) + 1):
+                ngram = tuple(toks[pos:end])
+                if ngram in positions:
+                    positions[ngram].append(pos)
+                else:
+                    positions[ngram] = [pos]
+
+    def find(self, needle):
+        """Return the first position of the needle (a tuple of tokens) in the sequence, or -1.
+        Needles longer than the indexed n-grams are searched for linearly."""
+        if len(needle) > self.max_len:
+            return sublist_pos(list(needle), self.toks)
+        return self.positions.get(needle, [-1])[0]
+
+    def find_all(self, needle):
+        """Return all positions of the needle (a tuple of tokens) in the sequence, in ascending order."""
+        if len(needle) > self.max_len:
+            n = len(needle)
+            return [pos for pos in xrange(len(self.toks) - n + 1) if tuple(self.toks[pos:pos+n]) == needle]
+        return self.positions.get(needle, [])
+
+
 class Delexicalizer(object):
 
-    def __init__(self, slots, surface_forms, tagger_model, tagger_overrides, output_format='plain'):
+    # conjunctions allowed between coordinated values, in the order in which they are tried
+    COORD_CONJUNCTIONS = [('a',), ('nebo',), ('i',), ('či',)]
+
+    def __init__(self, slots, surface_forms, tagger_model, tagger_overrides, output_format='plain', jobs=1):
         self.slots = slots.split(',')
         self.surface_forms = None
         if surface_forms:
             log_info("Loading surface forms...")
             with codecs.open(surface_forms, 'rb', 'UTF-8') as fh:
                 self.surface_forms = json.load(fh)
+        # sentence lemmas are indexed by n-grams up to the longest surface form (+1 for house numbers)
+        max_form_len = 1
+        if self.surface_forms:
+            max_form_len = max(len(sf.split(' ')) for values in self.surface_forms.values()
+                               for forms in values.values() for sf in forms) + 1
+        self.lemma_index = NgramIndex(max_form_len)
+        # (slot, value) -> candidate surface forms as tuples of lemmas
+        self.surface_forms_cache = {}
         self.tagger_overrides = None
         if tagger_overrides:
             log_info("Loading tagger overrides...")
             with codecs.open(tagger_overrides, 'rb', 'UTF-8') as fh:
                 self.tagger_overrides = json.load(fh)
         log_info("Loading tagger...")
+        self.tagger_model = tagger_model
         self.analyzer = Analyzer(tagger_model)
         self.output_format = output_format
+        self.jobs = jobs
 
-    def delexicalize_text(self, text, da, counter=-1):
-        """Delexicalize a single sentence (given the corresponding DA)."""
+    def delexicalize_text(self, text, da, counter=-1, analysis=None):
+        """Delexicalize a single sentence (given the corresponding DA).
+
+        @param analysis: Morphodita analysis of the text, if it is already tagged
+        """
         # run Morphodita
-        analysis = self.analyzer.analyze(text)
+        if analysis is None:
+            analysis = self.analyzer.analyze(text)
         # apply overrides
         if self.tagger_overrides:
             for pos, (form, lemma, tag) in enumerate(analysis):
@@ -63,25 +118,19 @@ class Delexicalizer(object):
         tags = [tok[2] for tok in analysis]
         delex = [tok[0] for tok in analysis]
         vals_to_forms = []
+        self.lemma_index.reset(lemmas)
         for dai in da:
             if dai.slot not in self.slots and (dai.slot != 'address' or 'street' not in self.slots):
                 continue
             if not dai.value or dai.value in ['dont care', 'dont_care', 'none']:
                 continue
-            surface_forms = self.get_surface_forms(dai.slot, dai.value)
-
-            found = False
-            for sf in surface_forms:
-                pos = sublist_pos(sf, lemmas)
-                if pos != -1:
-                    found = True
-                    form = self.get_form(tags, pos, sf)
-                    vals_to_forms.append((dai.slot, dai.value, form, delex[pos:pos+len(sf)]))
-                    delex[pos] = 'X-' + dai.slot + form
-                    delex[pos+1:pos+len(sf)] = [None] * (len(sf) - 1)
-                    break
-
-            if not found:
+            pos, sf = self.find_surface_form(dai.slot, dai.value)
+            if pos != -1:
+                form = self.get_form(tags, pos, sf)
+                vals_to_forms.append((dai.slot, dai.value, form, delex[pos:pos+len(sf)]))
+                delex[pos] = 'X-' + dai.slot + form
+                delex[pos+1:pos+len(sf)] = [None] * (len(sf) - 1)
+            else:
                 # print out everything that couldn't be found -- error checking in the set
                 print >> sys.stderr, (unicode(counter) + ': Not found: ' + dai.value + ' | ' +
                                       unicode(da) + ' | ' + text)
@@ -101,6 +150,18 @@ class Delexicalizer(object):
             return [lemma for tok, lemma in zip(delex, lemmas) if tok is not None]
         return [tok for tok in delex if tok is not None]
 
+    def delexicalize_texts(self, texts, das, start=0):
+        """Delexicalize a batch of sentences (given the corresponding DAs). The sentences are
+        tagged in `self.jobs` parallel processes; the lemma index and the candidate surface forms
+        of the slot values are reused across the sentences.
+
+        @param start: counter of the first sentence (used in error messages)
+        @return: list of the results of `delexicalize_text`
+        """
+        analyses = analyze_texts(texts, self.analyzer, Analyzer, (self.tagger_model,), self.jobs)
+        return [self.delexicalize_text(text, da, counter, analysis)
+                for counter, (text, da, analysis) in enumerate(zip(texts, das, analyses), start)]
+
     def delexicalize_da(self, da):
         """Delexicalize a single DA."""
         da = [DAI(dai.dat, dai.slot, dai.value) for dai in da]  # deep copy
@@ -113,10 +174,70 @@ class Delexicalizer(object):
             dai.value = 'X-' + dai.slot
         return da
 
+    def find_surface_form(self, slot, value):
+        """Find the first possible surface form of the given slot and value in the indexed lemmas
+        of the current sentence.
+
+        @return: a tuple of the position and the surface form (tuple of lemmas), or (-1, None)
+        """
+        # price ranges ("between 130 and 180 Kč") are templates, not coordinated values
+        if slot != 'price' and re.search(r'\s+(and|or)\s+', value):
+            return self.find_coordination(slot, re.split(r'\s*(?:and|or)\s*', value))
+        for sf in self.get_cached_surface_forms(slot, value):
+            pos = self.lemma_index.find(sf)
+            if pos != -1:
+                return pos, sf
+        return -1, None
+
+    def find_coordination(self, slot, subvalues):
+        """Find coordinated values (e.g. 'lunch or dinner') in the indexed lemmas incrementally:
+        the forms of the first subvalue are anchored using the index, then the conjunction and the
+        next subvalue are checked right after them, and so on. The match is the same as when trying
+        all the combinations of the forms and conjunctions in order, but only the combinations that
+        occur in the sentence are extended.
+
+        @return: a tuple of the position and the surface form (tuple of lemmas), or (-1, None)
+        """
+        lemmas = self.lemma_index.toks
+        parts = [self.get_cached_surface_forms(slot, subvalue) for subvalue in subvalues]
+        # forms of the subvalues interleaved with conjunctions
+        options = [parts[0]]
+        for part in parts[1:]:
+            options.extend([self.COORD_CONJUNCTIONS, part])
+
+        def extend(level, starts, matched):
+            if level == len(options):
+                return starts[0], matched
+            offset = len(matched)
+            for option in options[level]:
+                end = offset + len(option)
+                option_starts = [start for start in starts if tuple(lemmas[start+offset:start+end]) == option]
+                if option_starts:
+                    result = extend(level + 1, option_starts, matched + option)
+                    if result:
+                        return result
+            return None
+
+        for sf in options[0]:
+            starts = self.lemma_index.find_all(sf)
+            if starts:
+                result = extend(1, starts, sf)
+                if result:
+                    return result
+        return -1, None
+
+    def get_cached_surface_forms(self, slot, value):
+        """Get all possible surface forms for the given slot and value as tuples of lemmas,
+        computed only once for each slot and value."""
+        key = (slot, value)
+        if key not in self.surface_forms_cache:
+            self.surface_forms_cache[key] = [tuple(sf) for sf in self.get_surface_forms(slot, value)]
+        return self.surface_forms_cache[key]
+
     def get_surface_forms(self, slot, value):
         """Get all possible surface forms (lemmas) for the given slot and value.
-        Works around coordination, price templates, and address (where only street names
-        must be in the surface forms list)."""
+        Works around price templates and address (where only street names must be in the
+        surface forms list). Coordinated values are matched by `find_coordination`."""
 
         if slot == 'price':
             prices = re.findall(r'[0-9]+', value)
@@ -126,13 +247,6 @@ class Delexicalizer(object):
                 surface_forms = [re.sub(r'_', price, vt, count=1) for vt in surface_forms]
             return [sf.split(' ') for sf in surface_forms]
 
-        if re.search(r'\s+(and|or)\s+', value):
-            sub_sf = [self.get_surface_forms(slot, subval)
-                      for subval in re.split(r'\s*(?:and|or)\s*', value)]
-            for pos in xrange(len(sub_sf)-1):
-                sub_sf.insert(2*pos+1, [['a'], ['nebo'], ['i'], ['či']])
-            return [[tok for sublist in sf_var for tok in sublist] for sf_var in product(*sub_sf)]
-
         if slot == 'address':
             street = ' '.join(value.split(' ')[:-1])
             num = value.split(' ')[-1]
@@ -181,6 +295,7 @@ def main():
     ap.add_argument('-t', '--tagger-model', type=str, help='Path to Morphodita tagger model')
     ap.add_argument('-o', '--tagger-overrides', type=str, help='Path to a JSON file with tagger overrides')
     ap.add_argument('-l', '--lemma-output', action='store_true', help='Output only lemmas instead of tokens?')
+    ap.add_argument('-j', '--jobs', type=int, default=1, help='Number of parallel tagger processes')
     ap.add_argument('text_file', type=str, help='Input lexicalized text file')
     ap.add_argument('da_file', type=str, help='Input DA file')
     ap.add_argument('out_file', type=str, help='Output delexicalized text file')
@@ -188,14 +303,11 @@ def main():
     args = ap.parse_args()
 
     delex = Delexicalizer(args.slots, args.surface_forms, args.tagger_model,
-                          'lemma' if args.lemma_output else 'plain')
+                          'lemma' if args.lemma_output else 'plain', jobs=args.jobs)
 
     texts = load_texts(args.text_file)
     das = load_dais(args.da_file)
-    delexs = []
-
-    for counter, (text, da) in enumerate(zip(texts, das)):
-        delexs.append(delex.delexicalize_text(text, da, counter))
+    delexs = delex.delexicalize_texts(texts, das)
 
     write_toks(args.out_file, delexs)
 
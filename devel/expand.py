@@ -4,7 +4,10 @@
 from __future__ import unicode_literals
 import re
 import sys
+import os
 import codecs
+import hashlib
+import json
 from argparse import ArgumentParser
 from util import load_dais, load_texts, write_das, write_texts, write_toks, DAI
 import kenlm
@@ -18,6 +21,95 @@ def da_key(da):
 
 
 
+def file_digest(file_name, block_size=1 << 20):
+    """SHA-1 digest of the file contents, read in blocks."""
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def group_softmax(scores, group_sizes):
+    """Normalize log scores into a probability distribution within each group (~ apply softmax),
+    in one vectorized pass over all the groups.
+
+    @param scores: scores of all groups, concatenated
+    @param group_sizes: number of scores in each group (all must be non-empty)
+    @return: list of probability arrays, one for each group
+    """
+    scores = np.asarray(scores, dtype=float)
+    group_sizes = np.asarray(group_sizes, dtype=int)
+    starts = np.concatenate(([0], np.cumsum(group_sizes)[:-1]))
+    scores = np.exp(scores - np.repeat(np.maximum.reduceat(scores, starts), group_sizes))
+    scores /= np.repeat(np.add.reduceat(scores, starts), group_sizes)
+    return np.split(scores, starts[1:])
+
+
+class LMScoreCache(object):
+    """Memoized KenLM scores of lemma sequences, optionally persisted to a JSON file between runs.
+    The file stores the size, modification time and digest of the LM file, so it is only used
+    with the same LM; the LM is hashed only if its size matches but its modification time does not.
+    The LM itself is loaded only when a sequence is not found in the cache."""
+
+    def __init__(self, lm_file, cache_file=None):
+        self.lm_file = lm_file
+        self.cache_file = cache_file
+        self.lm = None
+        self.scores = {}
+        self.changed = False
+        self.lm_digest = None
+        if cache_file and os.path.exists(cache_file):
+            self.load()
+
+    def load(self):
+        """Read the scores from the cache file, if it was saved with the same LM."""
+        try:
+            with open(self.cache_file, 'r') as fh:
+                data = json.load(fh)
+            lm_size, lm_mtime, lm_digest, scores = (data['lm_size'], data['lm_mtime'],
+                                                    data['lm_digest'], data['scores'])
+        except (ValueError, KeyError, TypeError):
+            log_info("LM score cache %s is not readable, ignoring it" % self.cache_file)
+            return
+        stat = os.stat(self.lm_file)
+        if lm_size != stat.st_size:
+            same_lm = False
+        elif lm_mtime == stat.st_mtime:
+            same_lm = True
+        else:  # touched or rewritten LM file, compare the contents
+            same_lm = file_digest(self.lm_file) == lm_digest
+        if not same_lm:
+            log_info("LM score cache %s is for a different LM, ignoring it" % self.cache_file)
+            return
+        self.lm_digest = lm_digest
+        self.scores = scores
+        self.changed = lm_mtime != stat.st_mtime  # store the new modification time on save
+        log_info("Loaded %d LM scores from %s" % (len(self.scores), self.cache_file))
+
+    def score(self, lemmas):
+        """LM score of a lemma sequence (given as a list of lemmas)."""
+        sent = " ".join(lemmas)
+        if sent not in self.scores:
+            if self.lm is None:
+                log_info("Loading LM...")
+                self.lm = kenlm.Model(self.lm_file)
+            self.scores[sent] = self.lm.score(sent)
+            self.changed = True
+        return self.scores[sent]
+
+    def save(self):
+        """Write the scores to the cache file, if there is one and there are new scores."""
+        if self.cache_file and self.changed:
+            if self.lm_digest is None:
+                self.lm_digest = file_digest(self.lm_file)
+            stat = os.stat(self.lm_file)
+            with open(self.cache_file, 'w') as fh:
+                json.dump({'lm_size': stat.st_size, 'lm_mtime': stat.st_mtime,
+                           'lm_digest': self.lm_digest, 'scores': self.scores}, fh)
+            self.changed = False
+
+
 class Expander(object):
 
     SPECIAL_VALUES = [None, '', 'dont_care', 'none', 'yes', 'no',
@@ -33,13 +125,13 @@ class Expander(object):
         # run delexicalization, store tokens + lemmas + tags, delex DAs
         self.delexicalizer = Delexicalizer(args.slots, args.surface_forms,
                                            args.tagger_model, args.tagger_overrides,
-                                           output_format='factors')
+                                           output_format='factors', jobs=args.jobs)
         log_info("Delexicalizing...")
         self.delex_texts = []
         self.delex_das = []
         vals_to_forms = []
-        for counter, (da, text) in enumerate(zip(self.transl_das, self.transl_texts)):
-            delex_text, v2f = self.delexicalizer.delexicalize_text(text, da, counter)
+        delex_results = self.delexicalizer.delexicalize_texts(self.transl_texts, self.transl_das)
+        for da, (delex_text, v2f) in zip(self.transl_das, delex_results):
             vals_to_forms.extend(v2f)
             self.delex_texts.append(delex_text)
             self.delex_das.append(self.delexicalizer.delexicalize_da(da))
@@ -55,8 +147,7 @@ class Expander(object):
         self.out_das = [None] * len(self.orig_das)
         self.out_delex_das = [None] * len(self.orig_das)
 
-        log_info("Loading LM...")
-        self.lm = kenlm.Model(args.lm)
+        self.lm = LMScoreCache(args.lm, args.lm_cache)
 
         self.out_texts_file = args.out_texts
         self.out_delex_texts_file = args.out_delex_texts
@@ -65,15 +156,30 @@ class Expander(object):
 
     def expand(self):
         log_info("Expanding...")
+        groups = []
         for da_key, (da, orig_pos) in self.orig_da_positions.iteritems():
             if da_key not in self.transl_da_positions:
                 print >> sys.stderr, "DA key not found: %s" % da_key
                 print >> sys.stderr, "Original positions: %s" % ", ".join([str(p) for p in orig_pos])
                 continue
             _, transl_pos = self.transl_da_positions[da_key]
-            self.expand_da(da, orig_pos, transl_pos)
+            groups.append((da, orig_pos, transl_pos))
+
+        # score all realizations by a LM (each distinct lemma sequence only once)
+        scores = [self.lm.score([lemma for _, lemma, _ in self.delex_texts[pos]])
+                  for _, _, transl_pos in groups for pos in transl_pos]
+        self.lm.save()
+        # normalize scores into a prob dist within each group
+        probs = group_softmax(scores, [len(transl_pos) for _, _, transl_pos in groups]) if groups else []
+
+        for (da, orig_pos, transl_pos), scores in zip(groups, probs):
+            self.expand_da(da, orig_pos, transl_pos, scores)
 
-    def expand_da(self, da, orig_pos, transl_pos):
+    def expand_da(self, da, orig_pos, transl_pos, scores):
+        """Expand the realizations of one DA group.
+
+        @param scores: probability distribution over the translated realizations (from their LM scores)
+        """
         # count # of different realizations for the given DA
         orig_count = len(orig_pos)
         transl_count = len(transl_pos)
@@ -82,17 +188,6 @@ class Expander(object):
         assert(transl_count > 0)
         assert(transl_count <= orig_count)
 
-        # score all realizations by a LM
-        scores = []
-        for pos in transl_pos:
-            scores.append(self.lm.score(" ".join([lemma for _, lemma, _ in self.delex_texts[pos]])))
-
-        # normalize scores into a prob dist (~ apply softmax)
-        max_score = max(scores)
-        scores = np.array(scores) - max_score
-        scores = np.exp(scores)
-        scores /= np.sum(scores)
-
         # save the original stuff into the new positions
         for opos_, tpos_ in zip(orig_pos, transl_pos):
             self.out_texts[opos_] = self.transl_texts[tpos_]
@@ -176,10 +271,13 @@ def main():
 
     ap.add_argument('-l', '--lm', type=str, help='KenLM language model on lowercased, delexicalized,' +
                     'tokenized texts')
+    ap.add_argument('-c', '--lm-cache', type=str, help='File to keep the LM scores in between runs ' +
+                    '(used only with the same LM)')
     ap.add_argument('-s', '--slots', type=str, help='List of slots to delexicalize')
     ap.add_argument('-f', '--surface-forms', type=str, help='Input file with surface forms for slot values')
     ap.add_argument('-t', '--tagger-model', type=str, help='Path to Morphodita tagger model')
     ap.add_argument('-o', '--tagger-overrides', type=str, help='Path to a JSON file with tagger overrides')
+    ap.add_argument('-j', '--jobs', type=int, default=1, help='Number of parallel tagger processes')
 
     ap.add_argument('orig_das', type=str, help='Input delexicalized original DAs')
 
@@ -7,8 +7,7 @@ import codecs
 import json
 import re
 from argparse import ArgumentParser
-from collections import deque, namedtuple
-from itertools import islice
+from collections import namedtuple
 
 import numpy as np
 import random
@@ -19,6 +18,9 @@ from ufal.morphodita import Tagger, Forms, TaggedLemma, TaggedLemmas, TokenRange
 import sys
 import os
 sys.path.insert(0, os.path.abspath('../../'))  # add tgen main directory to modules path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # add lexicon to modules path
+from lexicon import load_lexicon
+from util import analyze_texts
 from tgen.logf import log_info
 from tgen.data import Abst, DAI, DA
 
@@ -34,6 +36,9 @@ Inst = namedtuple('Inst', ['da', 'text', 'delex_da', 'delex_text', 'abst'])
 class Reader(object):
 
     def __init__(self, tagger_model, abst_slots):
+        self._tagger_model = tagger_model
+        self._abst_slots_list = abst_slots
+        self._surface_forms_fnames = []
         self._tagger = Tagger.load(tagger_model)
         self._analyzer = self._tagger.getMorpho()
         self._tokenizer = self._tagger.newTokenizer()
@@ -44,55 +49,61 @@ class Reader(object):
         self._analyses_buf = Analyses()
         self._indices_buf = Indices()
 
-        self._sf_dict = {}
+        # trie over normalized tokens of the surface forms (numbers are matched by the "_" edge),
+        # the analyses of a complete surface form are stored in its node under the None key
+        self._sf_trie = {}
         self._rev_sf_dict = {}
-        self._sf_max_len = 0
 
     def load_surface_forms(self, surface_forms_fname):
         """Load all proper name surface forms from a file."""
-        with codecs.open(surface_forms_fname, 'rb', 'UTF-8') as fh:
-            data = json.load(fh)
-        for slot, values in data.items():
-            for value in values.keys():
-                for surface_form in values[value]:
-                    lemma, form, tag = surface_form.split("\t")
-                    form_toks = form.lower().split(" ")
-                    if slot == 'street':  # add street number placeholders to addresses
-                        lemma += ' _'
-                        form_toks.append('_')
-                    form_toks = tuple(form_toks)
-                    self._sf_max_len = max((self._sf_max_len, len(form_toks)))
-                    if form_toks not in self._sf_dict:
-                        self._sf_dict[form_toks] = []
-                    self._sf_dict[form_toks].append((lemma, tag))
-                    self._rev_sf_dict[(form.lower(), lemma, tag)] = (slot, value)
-
-    def _get_surface_form_taggedlemmas(self, forms_in):
-        """Given a tokens deque, return the form & list of tagged lemmas (analyses)
-        for the proper name in the list of forms at the current position, if applicable.
-        If there is no proper name at the beginning of the tokens deque, return (None, None).
-
-        @param forms_in: a deque of forms tokens
-        @return: (form, tagged lemmas list) or (None, None)
+        self._surface_forms_fnames.append(surface_forms_fname)
+        lexicon = load_lexicon(surface_forms_fname)
+        for form_toks, analyses in lexicon.form_index.items():
+            node = self._sf_trie
+            for tok in form_toks:
+                node = node.setdefault(tok, {})
+            node.setdefault(None, []).extend(analyses)
+        self._rev_sf_dict.update(lexicon.reverse_index)
+
+    @staticmethod
+    def _normalize_forms(forms):
+        """Normalize forms tokens for the surface forms lookup: lowercase, numbers replaced by "_"."""
+        return ['_' if re.match(r'^[0-9]+$', form) else form.lower() for form in forms]
+
+    def _get_surface_form_taggedlemmas(self, forms, norm_forms, start):
+        """Given the forms of a sentence, return the form & list of tagged lemmas (analyses)
+        for the longest proper name at the given position, if applicable, together with its
+        length in tokens. If there is no proper name at the position, return (None, None, 0).
+
+        @param forms: a list of forms tokens
+        @param norm_forms: the forms normalized by `_normalize_forms`
+        @param start: the current position in the sentence
+        @return: (form, tagged lemmas list, number of tokens) or (None, None, 0)
         """
-        for test_len in range(min(self._sf_max_len, len(forms_in)), 0, -1):
-            # test the string, handle number placeholders
-            full_substr = [form for form in islice(forms_in, 0, test_len)]
-            test_substr = tuple(['_' if re.match(r'^[0-9]+$', form) else form.lower()
-                                 for form in full_substr])
-            if test_substr in self._sf_dict:
-                tls = TaggedLemmas()
-                nums = [num for num in full_substr if re.match(r'^[0-9]+$', num)]
-                for lemma, tag in self._sf_dict[test_substr]:
-                    tls.push_back(TaggedLemma())
-                    for num in nums:  # replace number placeholders by actual values
-                        lemma = re.sub(r'_', num, lemma, count=1)
-                    tls[-1].lemma = lemma
-                    tls[-1].tag = tag
-                for _ in range(len(test_substr)):  # move on in the sentence
-                    forms_in.popleft()
-                return " ".join(full_substr), tls
-        return None, None
+        # walk the trie as far as the sentence allows, remember the longest complete surface form
+        node = self._sf_trie
+        match_len = 0
+        match_analyses = None
+        for pos in range(start, len(forms)):
+            node = node.get(norm_forms[pos])
+            if node is None:
+                break
+            if None in node:
+                match_len = pos - start + 1
+                match_analyses = node[None]
+        if not match_len:
+            return None, None, 0
+
+        full_substr = forms[start:start + match_len]
+        tls = TaggedLemmas()
+        nums = [num for num in full_substr if re.match(r'^[0-9]+$', num)]
+        for lemma, tag in match_analyses:
+            tls.push_back(TaggedLemma())
+            for num in nums:  # replace number placeholders by actual values
+                lemma = re.sub(r'_', num, lemma, count=1)
+            tls[-1].lemma = lemma
+            tls[-1].tag = tag
+        return " ".join(full_substr), tls, match_len
 
     def analyze(self, sent):
         """Perform morphological analysis on the given sentence, preferring analyses from the
@@ -101,18 +112,22 @@ class Reader(object):
         analyzed = []
         while self._tokenizer.nextSentence(self._forms_buf, self._tokens_buf):
 
-            forms_in = deque(self._forms_buf)
+            forms = list(self._forms_buf)
+            norm_forms = self._normalize_forms(forms)
             self._forms_buf.resize(0)
             self._analyses_buf.resize(0)  # reset previous analyses
 
-            while forms_in:
-                form, analyses = self._get_surface_form_taggedlemmas(forms_in)
+            pos = 0
+            while pos < len(forms):
+                form, analyses, length = self._get_surface_form_taggedlemmas(forms, norm_forms, pos)
                 if form:
                     # our custom analysis
                     self._analyses_buf.push_back(analyses)
+                    pos += length
                 else:
                     # Morphodita analysis
-                    form = forms_in.popleft()
+                    form = forms[pos]
+                    pos += 1
                     analyses = TaggedLemmas()
                     self._analyzer.analyze(form, 1, analyses)
                     for i in range(len(analyses)):  # shorten lemmas (must access the vector directly)
@@ -128,21 +143,25 @@ class Reader(object):
                              in zip(self._forms_buf, self._analyses_buf, self._indices_buf)])
         return analyzed
 
-    def process_dataset(self, input_data):
+    def process_dataset(self, input_data, jobs=1):
         """Load DAs & sentences, obtain abstraction instructions, and store it all in member
         variables (to be used later by writing methods).
         @param input_data: path to the input JSON file with the data
+        @param jobs: number of parallel processes used for tagging the sentences
         """
         # load data from JSON
         self._das = []
-        self._texts = []
+        texts = []
         with codecs.open(input_data, 'r', encoding='UTF-8') as fh:
             data = json.load(fh)
             for inst in data:
                 da = DA.parse(inst['da'])
                 da.sort()
                 self._das.append(da)
-                self._texts.append(self.analyze(inst['text']))
+                texts.append(inst['text'])
+        # tag the sentences, each worker loads its own reader with the same surface forms
+        self._texts = analyze_texts(texts, self, load_reader,
+                                    (self._tagger_model, self._abst_slots_list, self._surface_forms_fnames), jobs)
 
         # delexicalize DAs and sentences
         self._create_delex_texts()
@@ -240,6 +259,14 @@ class Reader(object):
         self._delex_das = out
 
 
+def load_reader(tagger_model, abst_slots, surface_forms_fnames):
+    """Create a reader with the given surface forms files loaded (used in the tagging worker processes)."""
+    reader = Reader(tagger_model, abst_slots)
+    for surface_forms_fname in surface_forms_fnames:
+        reader.load_surface_forms(surface_forms_fname)
+    return reader
+
+
 class Writer(object):
 
     def __init__(self):
@@ -278,7 +305,7 @@ def convert(args):
     reader = Reader(args.tagger_model, args.abst_slots)
     reader.load_surface_forms(args.surface_forms)
     log_info('Processing input files...')
-    insts = reader.process_dataset(args.input_data)
+    insts = reader.process_dataset(args.input_data, args.jobs)
     log_info('Loaded %d data items.' % len(insts))
 
     # regroup data by delex DA & split from there
@@ -345,6 +372,7 @@ if __name__ == '__main__':
     ap.add_argument('out_prefix', help='Output files name prefix(es - when used with -s, comma-separated)')
     ap.add_argument('-a', '--abst-slots', help='List of slots to delexicalize/abstract (comma-separated)')
     ap.add_argument('-s', '--split', help='Colon-separated sizes of splits (e.g.: 3:1:1)')
+    ap.add_argument('-j', '--jobs', type=int, default=1, help='Number of parallel tagger processes')
 
     args = ap.parse_args()
     convert(args)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sys
+
+import pytest
+
+if sys.version_info[0] > 2:
+    pytest.skip('the devel scripts use Python 2', allow_module_level=True)
+pytest.importorskip('ufal.morphodita')
+pytest.importorskip('recordclass')
+pytest.importorskip('tgen')
+
+from delexicalize import Delexicalizer, NgramIndex
+
+
+SURFACE_FORMS = {
+    'price': {
+        'between _ and _ Kč': ['mezi _ a _ kč', 'od _ do _ kč'],
+        '_ Kč': ['_ kč'],
+    },
+    'good_for_meal': {
+        'lunch': ['oběd'],
+        'dinner': ['večeře'],
+    },
+}
+
+
+def get_delexicalizer(surface_forms):
+    """A delexicalizer with the given surface forms and without the tagger (the sentences are given as lemmas)."""
+    delex = Delexicalizer.__new__(Delexicalizer)
+    delex.slots = ['price', 'good_for_meal']
+    delex.surface_forms = surface_forms
+    delex.lemma_index = NgramIndex(6)
+    delex.surface_forms_cache = {}
+    return delex
+
+
+def test_find_price_range():
+    delex = get_delexicalizer(SURFACE_FORMS)
+    assert delex.get_surface_forms('price', 'between 130 and 180 Kč') == [
+        ['mezi', '130', 'a', '180', 'kč'], ['od', '130', 'do', '180', 'kč']]
+
+    # the "and" of a price range is not a coordination of two values
+    delex.lemma_index.reset('ceny jsou od 130 do 180 kč'.split(' '))
+    assert delex.find_surface_form('price', 'between 130 and 180 Kč') == (2, ('od', '130', 'do', '180', 'kč'))
+    assert delex.find_surface_form('price', '130 Kč') == (-1, None)
+
+
+def test_find_coordination():
+    delex = get_delexicalizer(SURFACE_FORMS)
+    delex.lemma_index.reset('podávat oběd i večeře'.split(' '))
+    assert delex.find_surface_form('good_for_meal', 'lunch and dinner') == (1, ('oběd', 'i', 'večeře'))
+    assert delex.find_surface_form('good_for_meal', 'dinner or lunch') == (-1, None)
+
+
+if __name__ == '__main__':
+    test_find_price_range()
+    test_find_coordination()
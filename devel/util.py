@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 
 from ufal.morphodita import Tagger, Forms, TaggedLemmas, TokenRanges, Morpho, TaggedLemmasForms
 from recordclass import recordclass
+from multiprocessing import Pool
 import re
 import codecs
 
@@ -172,6 +173,41 @@ class Analyzer(object):
         return out
 
 
+# the analyzer of the current worker process of `analyze_texts`
+_worker_analyzer = None
+
+
+def _init_analyzer_worker(analyzer_factory, factory_args):
+    global _worker_analyzer
+    _worker_analyzer = analyzer_factory(*factory_args)
+
+
+def _analyze_in_worker(text):
+    return _worker_analyzer.analyze(text)
+
+
+def analyze_texts(texts, analyzer, analyzer_factory=None, factory_args=(), jobs=1, chunk_size=64):
+    """Analyze/tag a list of texts, either serially or using a pool of worker processes.
+    Each worker creates its own analyzer (i.e. loads the tagger model only once) and gets the
+    texts in chunks; the results are returned in the input order, the same as in the serial run.
+
+    @param analyzer: the analyzer used for the serial run (any object with an `analyze` method)
+    @param analyzer_factory: callable creating the analyzer in each worker (e.g. `Analyzer`)
+    @param factory_args: arguments of the factory (e.g. the tagger model path)
+    @param jobs: number of worker processes (1 = serial run with the given analyzer)
+    @param chunk_size: number of texts sent to a worker at once
+    @return: list of analyses (lists of (form, lemma, tag) tuples), one for each text
+    """
+    if jobs <= 1 or len(texts) <= chunk_size:
+        return [analyzer.analyze(text) for text in texts]
+    pool = Pool(jobs, _init_analyzer_worker, (analyzer_factory, factory_args))
+    try:
+        return list(pool.imap(_analyze_in_worker, texts, chunk_size))
+    finally:
+        pool.close()
+        pool.join()
+
+
 class Generator(object):
     """Morphodita generator wrapper, with support for inflecting
     noun phrases (stop/city names, personal names)."""
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The surface forms lexicon (`surface_forms.json`) with lookup tables built on first use (works with Python 2 and 3)."""
+
+from __future__ import unicode_literals
+
+import io
+import json
+
+
+class Lexicon(object):
+    """The surface forms lexicon with its lookup tables, built on first use.
+
+    surface_forms: slot -> value -> list of "lemma<TAB>form<TAB>tag" strings, as in the JSON file
+    entries: slot -> value -> list of (lemma, form, tag) tuples
+    forms: slot -> value -> list of forms
+    form_index: tuple of lowercased form tokens -> list of (lemma, tag); the lemmas and forms
+        of streets end with a "_" placeholder for the house number
+    reverse_index: (lowercased form, lemma, tag) -> (slot, value)
+    max_form_len: maximum number of tokens in `form_index`
+    """
+
+    def __init__(self, surface_forms):
+        self.surface_forms = surface_forms
+        self._entries = None
+        self._forms = None
+        self._indexes = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = {slot: {value: [tuple(surface_form.split("\t")) for surface_form in value_surface_forms]
+                                    for value, value_surface_forms in values.items()}
+                             for slot, values in self.surface_forms.items()}
+        return self._entries
+
+    @property
+    def forms(self):
+        if self._forms is None:
+            # only the forms are split out, without building the entries
+            self._forms = {slot: {value: [surface_form.split("\t")[1] for surface_form in value_surface_forms]
+                                  for value, value_surface_forms in values.items()}
+                           for slot, values in self.surface_forms.items()}
+        return self._forms
+
+    @property
+    def form_index(self):
+        return self._get_indexes()[0]
+
+    @property
+    def reverse_index(self):
+        return self._get_indexes()[1]
+
+    @property
+    def max_form_len(self):
+        return self._get_indexes()[2]
+
+    def _get_indexes(self):
+        """Builds the form index and the reverse index together, in one pass over the entries."""
+        if self._indexes is None:
+            form_index = {}
+            reverse_index = {}
+            max_form_len = 0
+            for slot, values in self.entries.items():
+                for value, value_entries in values.items():
+                    for lemma, form, tag in value_entries:
+                        form_toks = form.lower().split(" ")
+                        if slot == 'street':  # add street number placeholders to addresses
+                            lemma += ' _'
+                            form_toks.append('_')
+                        form_toks = tuple(form_toks)
+                        max_form_len = max(max_form_len, len(form_toks))
+                        form_index.setdefault(form_toks, []).append((lemma, tag))
+                        reverse_index[(form.lower(), lemma, tag)] = (slot, value)
+            self._indexes = (form_index, reverse_index, max_form_len)
+        return self._indexes
+
+
+def load_lexicon(json_file):
+    """Loads the surface forms lexicon from the JSON file.
+
+    Args:
+        json_file (str): the JSON surface forms file
+
+    Returns:
+        Lexicon: the lexicon
+    """
+    with io.open(json_file, 'r', encoding='UTF-8') as fh:
+        return Lexicon(json.load(fh))
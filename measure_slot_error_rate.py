@@ -1,11 +1,35 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
+import array
+import asyncio
+import concurrent.futures
+import copy
 import csv
+import glob
+import heapq
 import os
 import json
 import re
 import logging
+import math
+import operator
+import multiprocessing
+import socket
+import stat
+import tempfile
+import time
+from collections import Counter, defaultdict, deque, namedtuple
+from contextlib import nullcontext
+from functools import lru_cache
+from itertools import compress, islice, tee, zip_longest
+from sys import intern, stdin, stderr
+
+from lexicon import Lexicon, load_lexicon
+
+# NumPy is only needed for the per-instance arrays and the significance tests,
+# it is imported by `require_numpy` so that it does not slow down the start of the script
+np = None
 
 def read_lines(txt_file):
     with open(txt_file, newline='') as txtfile:
@@ -22,16 +46,116 @@ def read_csv(csv_file):
         fields = list(reader)
         return fields
 
-def load_data(surface_forms_file, ref_file, sys_file):
-    """Loads the data using helper functions. 
-    For ref_file it loads it in correct format according to its extension"""
-    surface_forms = read_json(surface_forms_file)
+def open_input(input_file, newline=None):
+    """Opens the file for reading, "-" stands for the standard input (which is not closed afterwards)"""
+    if input_file == "-":
+        return nullcontext(stdin)
+    return open(input_file, newline=newline)
+
+def iter_lines(txt_file):
+    """Lazily reads the lines of a text file (or standard input)"""
+    with open_input(txt_file, newline='') as txtfile:
+        for line in txtfile:
+            yield line.rstrip()
+
+def iter_csv(csv_file):
+    """Lazily reads the rows of a CSV file (or standard input)"""
+    with open_input(csv_file, newline='') as csvfile:
+        yield from csv.DictReader(csvfile)
+
+def iter_json(json_file, chunk_size=65536):
+    """Lazily reads the items of a JSON array from a file (or standard input),
+    without loading the whole file into memory"""
+    decoder = json.JSONDecoder()
+    with open_input(json_file) as fh:
+        buffer = ""
+        position = 0
+        eof = False
+        state = "start"
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position == len(buffer) or state == "incomplete":
+                if eof:
+                    raise ValueError(f"Unexpected end of the JSON array in {json_file}")
+                chunk = fh.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                if state == "incomplete":
+                    state = "item"
+                continue
+
+            if state == "start":
+                if buffer[position] != "[":
+                    raise ValueError(f"Expected a JSON array in {json_file}")
+                position += 1
+                state = "first_item"
+            elif state in ("first_item", "item"):
+                if state == "first_item" and buffer[position] == "]":
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    state = "incomplete"
+                    continue
+                # The item may continue in the next chunk (e.g. a number, "12." decodes as 12),
+                # so it is complete only when followed by a separator
+                if not eof:
+                    next_position = end
+                    while next_position < len(buffer) and buffer[next_position].isspace():
+                        next_position += 1
+                    if next_position == len(buffer) or buffer[next_position] not in ",]":
+                        state = "incomplete"
+                        continue
+                yield item
+                position = end
+                state = "separator"
+            else:
+                char = buffer[position]
+                position += 1
+                if char == ",":
+                    state = "item"
+                elif char == "]":
+                    return
+                else:
+                    raise ValueError(f"Unexpected character '{char}' in the JSON array in {json_file}")
+
+def iter_ref(ref_file, ref_format=None):
+    """Lazily reads the references, the format is given by the file extension unless specified"""
+    if ref_format is None:
+        ref_format = os.path.splitext(ref_file)[1][1:]
+    if ref_format == "csv":
+        return iter_csv(ref_file)
+    elif ref_format == "json":
+        return iter_json(ref_file)
+    raise ValueError(f"Unknown format of the references file {ref_file}, please specify it")
 
+def load_ref(ref_file):
+    """Loads the references in correct format according to the file extension"""
     ref_file_ext = os.path.splitext(ref_file)[1]
     if ref_file_ext == ".csv":
         ref = read_csv(ref_file)
     elif ref_file_ext == ".json":
         ref = read_json(ref_file)
+    return ref
+
+def read_surface_forms(surface_forms_file):
+    """Loads the surface forms lexicon (see `lexicon`)
+
+    Returns:
+        Lexicon: the surface forms, which can be passed to `Evaluator`
+    """
+    return load_lexicon(surface_forms_file)
+
+def load_data(surface_forms_file, ref_file, sys_file):
+    """Loads the data using helper functions. 
+    For ref_file it loads it in correct format according to its extension"""
+    surface_forms = read_surface_forms(surface_forms_file)
+
+    ref = load_ref(ref_file)
 
     das = [row["da"] for row in ref]
 
@@ -43,6 +167,75 @@ def load_data(surface_forms_file, ref_file, sys_file):
     assert len(das) == len(sys), f"Number of references and system outputs must match ({len(das)} != {len(sys)})"
     return surface_forms, das, sys
 
+def read_nbest(nbest_file, nbest_size=None):
+    """Reads the n-best lists of system outputs, one list for each DA.
+    The file is either in the Moses format ("ID ||| hypothesis ||| ...", the IDs are the indices
+    of the DAs counted from 0), or, if nbest_size is given, a text file with nbest_size consecutive
+    lines for each DA.
+
+    Returns:
+        List[List[str]]: the hypotheses for each DA, in the order of the file
+    """
+    lines = read_lines(nbest_file)
+    if nbest_size:
+        assert len(lines) % nbest_size == 0, f"Number of lines in {nbest_file} must be a multiple of the n-best list size {nbest_size}"
+        return [lines[start:start+nbest_size] for start in range(0, len(lines), nbest_size)]
+
+    nbest_lists = []
+    for line in lines:
+        if not line:
+            continue
+        fields = line.split(" ||| ")
+        assert len(fields) >= 2, f"Invalid n-best list line in {nbest_file}: {line}"
+        da_index = int(fields[0])
+        assert da_index >= len(nbest_lists) - 1, f"The n-best lists in {nbest_file} must be ordered by ID: {line}"
+        while len(nbest_lists) <= da_index:
+            nbest_lists.append([])
+        nbest_lists[da_index].append(fields[1].strip())
+    for da_index, hypotheses in enumerate(nbest_lists):
+        assert hypotheses, f"No hypotheses for the DA {da_index} in {nbest_file}"
+    return nbest_lists
+
+def expand_sys_files(sys_files):
+    """Expands glob patterns in the list of system output files, keeping the order.
+    Patterns that do not match any file are kept as they are."""
+    expanded = []
+    for sys_file in sys_files:
+        matches = sorted(glob.glob(sys_file)) if glob.has_magic(sys_file) else []
+        for match in matches or [sys_file]:
+            if match not in expanded:
+                expanded.append(match)
+    return expanded
+
+def load_many_data(surface_forms_file, ref_file, sys_files):
+    """Loads the surface forms and references once, and the output of each system.
+
+    Returns:
+        tuple: surface forms, DA lines and a dictionary system file -> system output lines
+    """
+    surface_forms = read_surface_forms(surface_forms_file)
+    das, systems = load_systems(ref_file, sys_files)
+    return surface_forms, das, systems
+
+def load_systems(ref_file, sys_files):
+    """Loads the references and the output of each system, the reference texts
+    are used as the output (under the name of ref_file) if there are no system files.
+
+    Returns:
+        tuple: DA lines and a dictionary system file -> system output lines
+    """
+    ref = load_ref(ref_file)
+    das = [row["da"] for row in ref]
+    if not sys_files:
+        return das, {ref_file: [row["text"] for row in ref]}
+
+    systems = {}
+    for sys_file in sys_files:
+        sys = read_lines(sys_file)
+        assert len(das) == len(sys), f"Number of references and system outputs in {sys_file} must match ({len(das)} != {len(sys)})"
+        systems[sys_file] = sys
+    return das, systems
+
 def parse_da(da):
     """Parses one line of Dialogue Act in the form of "DA_TYPE(SLOT=VALUE,...)".
 
@@ -103,10 +296,829 @@ def parse_da(da):
         "attributes": parsed_attributes
     }
 
+class ParsedDA(namedtuple("ParsedDA", ["type", "attributes"])):
+    """Immutable (and hashable) parsed Dialogue Act. The attributes are a tuple
+    of (slot, values) pairs, where the values are a tuple as well."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, da):
+        """Creates the DA from the output of `parse_da`, interning the DA type and slot names"""
+        return cls(intern(da["type"]), tuple((intern(slot), tuple(values)) for slot, values in da["attributes"].items()))
+
+    def to_dict(self):
+        """Returns the DA in the format of `parse_da`"""
+        return {
+            "type": self.type,
+            "attributes": {slot: list(values) for slot, values in self.attributes}
+        }
+
+PARSE_DA_CACHE_SIZE = 65536
+
+def _parse_da_immutable(da):
+    return ParsedDA.from_dict(parse_da(da))
+
+# Cache of the parsed DAs (the same DA strings repeat many times in the data)
+_parse_da_lru = lru_cache(maxsize=PARSE_DA_CACHE_SIZE)(_parse_da_immutable)
+
+def parse_da_cached(da):
+    """Parses one line of Dialogue Act into an immutable `ParsedDA`, using a LRU cache.
+    The returned object is shared by all callers with the same DA string."""
+    return _parse_da_lru(da)
+
+def set_parse_da_cache_size(maxsize):
+    """Replaces the cache of `parse_da_cached` by an empty one of the given size (None for unbounded)"""
+    global _parse_da_lru
+    _parse_da_lru = lru_cache(maxsize=maxsize)(_parse_da_immutable)
+
+def parse_da_cache_stats():
+    """Returns the statistics of the `parse_da_cached` cache, including its hit rate"""
+    info = _parse_da_lru.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "maxsize": info.maxsize,
+        "currsize": info.currsize,
+        "hit_rate": info.hits / lookups if lookups else 0,
+    }
+
+class InstanceResult(namedtuple("InstanceResult", [
+        "num_slot_values", "num_valid_slot_values", "num_missing_slot_value_error",
+        "num_additional_slot_value_error", "num_cannot_check_slot_values", "num_type_slots"])):
+    """Result of evaluating one system output: the total number of slot values in the DA,
+    the number of the checked ones, missing and additional slot errors and the number
+    of slot values we cannot check (out of which `num_type_slots` are the type slots)."""
+
+    __slots__ = ()
+
+    @property
+    def slot_errors(self):
+        return self.num_missing_slot_value_error + self.num_additional_slot_value_error
+
+def have_numpy():
+    """Imports NumPy on first use, returns False if it is not installed"""
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:
+            return False
+    return True
+
+def require_numpy():
+    if not have_numpy():
+        raise ImportError("NumPy is required for significance testing, please install it")
+
+class InstanceArrays(namedtuple("InstanceArrays", ["missing", "additional", "unchecked", "slots"])):
+    """Per-instance numbers of missing and additional slot errors, unchecked slot values
+    and all slot values, aligned with the input order. These are NumPy arrays if NumPy is
+    installed, `array.array`s otherwise.
+
+    The result of any subset of the instances is a masked sum, see `result`.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_results(cls, instance_results, use_numpy=None):
+        """
+        Args:
+            instance_results (List[InstanceResult]): the per-instance results
+            use_numpy (bool): create NumPy arrays, by default if NumPy is installed
+        """
+        if use_numpy is None:
+            use_numpy = have_numpy()
+        elif use_numpy:
+            require_numpy()
+        if use_numpy:
+            make_array = lambda values: np.fromiter(values, dtype=np.int64, count=len(instance_results))
+        else:
+            make_array = lambda values: array.array("q", values)
+        return cls(
+            make_array(result.num_missing_slot_value_error for result in instance_results),
+            make_array(result.num_additional_slot_value_error for result in instance_results),
+            make_array(result.num_cannot_check_slot_values for result in instance_results),
+            make_array(result.num_slot_values for result in instance_results),
+        )
+
+    @property
+    def errors(self):
+        if isinstance(self.missing, array.array):
+            return array.array("q", map(operator.add, self.missing, self.additional))
+        return self.missing + self.additional
+
+    def subset(self, mask):
+        """Returns the arrays of the instances selected by the mask.
+
+        Args:
+            mask: a boolean value for each instance (a list or a NumPy array);
+                a NumPy array of instance indices also works with NumPy arrays
+        """
+        if isinstance(self.missing, array.array):
+            return InstanceArrays(*[array.array("q", compress(values, mask)) for values in self])
+        mask = np.asarray(mask)
+        return InstanceArrays(*[values[mask] for values in self])
+
+    def result(self, mask=None):
+        """Computes the Slot Error Rate of all instances, or of those selected by the mask (see `subset`).
+
+        Returns:
+            tuple: SER, slot errors, missing slot errors, additional slot errors
+        """
+        arrays = self if mask is None else self.subset(mask)
+        num_missing_slot_value_error = int(sum(arrays.missing))
+        num_additional_slot_value_error = int(sum(arrays.additional))
+        num_slot_values = int(sum(arrays.slots))
+        slot_errors = num_missing_slot_value_error + num_additional_slot_value_error
+        ser_score = slot_errors / num_slot_values if num_slot_values else 0
+        return ser_score, slot_errors, num_missing_slot_value_error, num_additional_slot_value_error
+
+def bootstrap_ser_ci(errors, slots, num_samples=1000, confidence=0.95, seed=None, max_chunk_size=10000000):
+    """Computes a bootstrap confidence interval of the Slot Error Rate from per-instance counts.
+    All resamples are evaluated at once as a matrix product (in chunks of at most
+    `max_chunk_size` elements).
+
+    Args:
+        errors (np.ndarray): number of slot errors in each instance
+        slots (np.ndarray): number of slot values in each instance
+        num_samples (int): number of bootstrap resamples
+        confidence (float): confidence level of the interval
+        seed (int): seed of the random generator
+
+    Returns:
+        tuple: lower and upper bound of the interval
+    """
+    require_numpy()
+    errors = np.asarray(errors, dtype=np.float64)
+    slots = np.asarray(slots, dtype=np.float64)
+    num_instances = len(errors)
+    rng = np.random.default_rng(seed)
+    chunk_size = max(1, max_chunk_size // max(1, num_instances))
+
+    sers = []
+    for start in range(0, num_samples, chunk_size):
+        size = min(chunk_size, num_samples - start)
+        # how many times each instance is drawn in each resample
+        weights = rng.multinomial(num_instances, np.full(num_instances, 1 / num_instances), size=size)
+        sample_slots = weights @ slots
+        sers.append(np.divide(weights @ errors, sample_slots, out=np.zeros(size), where=sample_slots > 0))
+    sers = np.concatenate(sers)
+
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(sers, [alpha, 1 - alpha])
+    return float(lower), float(upper)
+
+def paired_randomization_test(errors_a, errors_b, num_samples=10000, seed=None, max_chunk_size=10000000):
+    """Paired approximate randomization test of the difference in Slot Error Rate of two systems
+    evaluated on the same DAs (so the total number of slot values is the same for both).
+    The outputs of the systems are swapped in each instance with probability 0.5.
+
+    Args:
+        errors_a (np.ndarray): number of slot errors in each instance for the first system
+        errors_b (np.ndarray): number of slot errors in each instance for the second system
+        num_samples (int): number of random swaps
+        seed (int): seed of the random generator
+
+    Returns:
+        float: p-value of the two-sided test
+    """
+    require_numpy()
+    assert len(errors_a) == len(errors_b), f"The systems must be evaluated on the same instances ({len(errors_a)} != {len(errors_b)})"
+    differences = np.asarray(errors_a, dtype=np.float64) - np.asarray(errors_b, dtype=np.float64)
+    num_instances = len(differences)
+    observed = abs(differences.sum())
+    rng = np.random.default_rng(seed)
+    chunk_size = max(1, max_chunk_size // max(1, num_instances))
+
+    num_at_least_observed = 0
+    for start in range(0, num_samples, chunk_size):
+        size = min(chunk_size, num_samples - start)
+        signs = rng.integers(0, 2, size=(size, num_instances)) * 2 - 1
+        num_at_least_observed += int(np.count_nonzero(np.abs(signs @ differences) >= observed - 1e-9))
+    return (num_at_least_observed + 1) / (num_samples + 1)
+
+class SlotErrorCounts(namedtuple("SlotErrorCounts", [
+        "num_das", "num_slot_values", "num_type_slots", "num_valid_slot_values",
+        "num_missing_slot_value_error", "num_additional_slot_value_error", "num_cannot_check_slot_values"])):
+    """Snapshot of the counters of a `SlotErrorAccumulator`"""
+
+    __slots__ = ()
+
+    @property
+    def slot_errors(self):
+        return self.num_missing_slot_value_error + self.num_additional_slot_value_error
+
+    @property
+    def ser(self):
+        return self.slot_errors / self.num_slot_values if self.num_slot_values else 0
+
+class SlotErrorAccumulator:
+    """Running totals of per-instance results. Accumulators of different parts of the data
+    (e.g. evaluated in different processes) can be merged."""
+
+    def __init__(self, keep_instance_results=False):
+        # The per-instance results in the input order, if requested
+        self.instance_results = [] if keep_instance_results else None
+        # Number of instances that were actually evaluated (not duplicates of already evaluated ones)
+        self.num_evaluated = 0
+        self.num_das = 0
+        self.num_slot_values = 0
+        self.num_type_slots = 0
+        self.num_valid_slot_values = 0
+        self.num_missing_slot_value_error = 0
+        self.num_additional_slot_value_error = 0
+        self.num_cannot_check_slot_values = 0
+
+    def add(self, instance_result, evaluated=True):
+        """Adds the `InstanceResult` of one system output
+
+        Args:
+            instance_result (InstanceResult): the result
+            evaluated (bool): False if the result was copied from an identical (DA, system output) pair
+        """
+        self.num_das += 1
+        self.num_evaluated += evaluated
+        self.num_slot_values += instance_result.num_slot_values
+        self.num_type_slots += instance_result.num_type_slots
+        self.num_valid_slot_values += instance_result.num_valid_slot_values
+        self.num_missing_slot_value_error += instance_result.num_missing_slot_value_error
+        self.num_additional_slot_value_error += instance_result.num_additional_slot_value_error
+        self.num_cannot_check_slot_values += instance_result.num_cannot_check_slot_values
+        if self.instance_results is not None:
+            self.instance_results.append(instance_result)
+        return self
+
+    def merge(self, other):
+        """Adds the totals of another accumulator (which follows this one in the input order)"""
+        for field in SlotErrorCounts._fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.num_evaluated += other.num_evaluated
+        if self.instance_results is not None and other.instance_results is not None:
+            self.instance_results.extend(other.instance_results)
+        return self
+
+    def instance_arrays(self):
+        """Returns the kept per-instance results as `InstanceArrays`"""
+        assert self.instance_results is not None, "The accumulator does not keep the per-instance results"
+        return InstanceArrays.from_results(self.instance_results)
+
+    @classmethod
+    def from_counts(cls, counts):
+        """Creates an accumulator with the given `SlotErrorCounts`"""
+        accumulator = cls()
+        for field, value in zip(SlotErrorCounts._fields, counts):
+            setattr(accumulator, field, value)
+        accumulator.num_evaluated = accumulator.num_das
+        return accumulator
+
+    @property
+    def dedup_ratio(self):
+        """Number of instances per evaluated unique (DA, system output) pair"""
+        return self.num_das / self.num_evaluated if self.num_evaluated else 1.0
+
+    @property
+    def counts(self):
+        return SlotErrorCounts(*[getattr(self, field) for field in SlotErrorCounts._fields])
+
+    def result(self):
+        """Checks the coverage of the counters and computes the Slot Error Rate.
+
+        Returns:
+            tuple: SER, slot errors, missing slot errors, additional slot errors
+        """
+        diff_cannot_check = self.num_slot_values - self.num_valid_slot_values
+        assert self.num_cannot_check_slot_values == diff_cannot_check, "The number of slots we know we cannot check should equal the total number of slots and the number of slots that we correctly handled"
+
+        slot_errors = self.num_missing_slot_value_error + self.num_additional_slot_value_error
+        if self.num_slot_values:
+            SER = slot_errors / self.num_slot_values
+        else:
+            SER = 0
+        return SER, slot_errors, self.num_missing_slot_value_error, self.num_additional_slot_value_error
+
+class PreparedDA(namedtuple("PreparedDA", ["line", "da", "attributes", "attribute_list", "num_slot_values"])):
+    """A parsed Dialogue Act with its slots in the order in which they are checked,
+    so that it can be evaluated against any number of system outputs.
+    The `da` is a shared (cached) `ParsedDA`, `attributes` map slots to tuples of values."""
+
+    __slots__ = ()
+
+    # Slots with lower priority are checked first
+    ATTRIBUTE_PRIORITIES = {
+        "kids_allowed": 10
+    }
+
+    @classmethod
+    def from_line(cls, da_line):
+        da = parse_da_cached(da_line)
+        attributes = dict(da.attributes)
+
+        num_slot_values = sum(len(values) for _, values in attributes.items())
+        # we count the empty slots as one value
+        num_slot_values += sum(len(values) == 0 for _, values in attributes.items())
+
+        attribute_list = [(slot, values, cls.ATTRIBUTE_PRIORITIES.get(slot, 99)) for slot, values in attributes.items()]
+        attribute_list = tuple(sorted(attribute_list, key=lambda x: x[2]))
+        return cls(da_line, da, attributes, attribute_list, num_slot_values)
+
+class PreparedSentence(namedtuple("PreparedSentence", ["text", "uncapitalized"])):
+    """A sentence together with its variant with lowercased first letter,
+    so that the variant is computed only once per sentence."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_text(cls, text):
+        if text:
+            return cls(text, text[0].lower() + text[1:])
+        return cls(text, text)
+
+class ConsumableSentence:
+    """A system output sentence from which the matched slot values are consumed.
+
+    Instead of rebuilding the sentence after each match, the matched spans are marked
+    in a mask over the characters of the original text. A match must not overlap
+    a consumed span and it must start at a token boundary, so that it is not found
+    inside a longer word. It may end inside a word, because the surface forms are
+    also matched as stems of other inflected forms (e.g. "Hradčan" in "Hradčanech"),
+    but not inside a number.
+    """
+
+    __slots__ = ("text", "uncapitalized", "capitalized", "consumed", "num_consumed", "_remaining")
+
+    def __init__(self, text):
+        self.text, self.uncapitalized = PreparedSentence.from_text(text)
+        # whether the uncapitalized variant differs (only in its first letter)
+        self.capitalized = self.text[:1] != self.uncapitalized[:1]
+        self.consumed = bytearray(len(text))
+        self.num_consumed = 0
+        # the text returned by `remaining`, kept until the next consumed span
+        self._remaining = text
+
+    def is_boundary(self, position):
+        """Checks that the position (an offset between two characters) is a token boundary."""
+        if position <= 0 or position >= len(self.text):
+            return True
+        return not (self.text[position - 1].isalnum() and self.text[position].isalnum())
+
+    def is_free(self, start, end):
+        """Checks that the span can be matched: it is not consumed, it starts at a token boundary
+        and it does not end inside a number."""
+        text = self.text
+        return (self.is_boundary(start)
+                and (end >= len(text) or not (text[end - 1].isdigit() and text[end].isdigit()))
+                and (not self.num_consumed or self.consumed.find(1, start, end) < 0))
+
+    def find(self, substring, start=0, uncapitalized=True):
+        """Returns the offset of the first free occurrence of the substring, or -1.
+
+        Args:
+            substring (str): the substring to search for
+            start (int): offset where the search starts
+            uncapitalized (bool): also try the uncapitalized variant of the sentence at its start
+        """
+        if not substring:
+            return -1
+        end = len(substring)
+        position = self.text.find(substring, start)
+        while position >= 0:
+            if self.is_free(position, position + end):
+                return position
+            position = self.text.find(substring, position + 1)
+        if uncapitalized and self.capitalized and start == 0 and self.uncapitalized.startswith(substring) \
+                and self.is_free(0, end):
+            return 0
+        return -1
+
+    def match(self, substring):
+        """Returns the first free occurrence of the substring (as written in the sentence), or False."""
+        position = self.find(substring)
+        if position >= 0:
+            return self.text[position:position+len(substring)]
+        return False
+
+    def consume(self, substring):
+        """Marks all the free occurrences of the substring as consumed.
+
+        Returns:
+            int: the number of the consumed occurrences
+        """
+        count = 0
+        length = len(substring)
+        position = self.find(substring, uncapitalized=False)
+        while position >= 0:
+            self.consumed[position:position+length] = b"\x01" * length
+            self.num_consumed += 1
+            count += 1
+            position = self.find(substring, position + length, uncapitalized=False)
+        if count:
+            self._remaining = None
+        return count
+
+    def remaining(self):
+        """Returns the text without the consumed spans, with deduplicated whitespaces.
+        The text is built only once after each change of the consumed spans."""
+        if self._remaining is None:
+            text = "".join(char for char, consumed in zip(self.text, self.consumed) if not consumed)
+            self._remaining = re.sub(" +", " ", text)
+        return self._remaining
+
+def surface_form_variants(forms):
+    """Returns an immutable tuple of deduplicated forms and their capitalized variants,
+    sorted from the longest to the shortest."""
+    variants = dict.fromkeys(list(forms) + [form.title() for form in forms])
+    return tuple(sorted(variants, key=len, reverse=True))
+
+class KidsNegationScanner:
+    """Looks for a word combination indicating kids_allowed=no in a sentence.
+
+    The regexes are compiled once for the given maximum word distance between
+    the negation and the word "děti", and sentences without any form of "děti"
+    are skipped without running them.
+    """
+
+    def __init__(self, max_word_distance):
+        self.max_word_distance = max_word_distance
+        distance = str(max_word_distance)
+        # The regexes are tried in this order, the first match is returned
+        self.regexes = [re.compile(regex, re.IGNORECASE) for regex in [
+            r"\b(ne\w*) (?:\w+ ){0,"+distance+r"}dět\w*",
+            # (?!a ) is there because of "... a ..." conjunction
+            r"dět\w* (?!a )(?:\w+ ){0,2}(ne\w+)",
+            r"(zakáz\w*|zákaz\w*) (?:\w+ ){0,"+distance+r"}dět\w*",
+            r"dět\w* (?:\w+ ){0,"+distance+r"}(zakáz\w*|zákaz\w*)",
+            r"(bez) (?:\w+ ){0,3}dět\w*",
+        ]]
+
+    def find(self, sentence):
+        """Returns the negation word found in the sentence, or False."""
+        # All the regexes need a form of "děti"
+        if "dět" not in sentence.lower():
+            return False
+        for regex in self.regexes:
+            matches = regex.search(sentence)
+            if matches:
+                return matches.group(1)
+        return False
+
+class SurfaceFormAutomaton:
+    """Aho-Corasick automaton over surface forms, used to find all lexicon hits
+    in a sentence in one left-to-right pass.
+
+    Each pattern carries a payload (e.g. an index of a slot value). The search
+    returns, for each payload, the longest (and then leftmost) matching substring.
+    """
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns (Iterable[Tuple[str, Any]]): pairs of (pattern string, payload)
+        """
+        # goto function, failure links, outputs ending exactly in the node
+        # and outputs including those reachable through failure links
+        self._goto = [{}]
+        self._fail = [0]
+        self._own = [[]]
+        self._out = [[]]
+
+        for pattern, payload in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._own.append([])
+                    self._out.append([])
+                node = next_node
+            if (len(pattern), payload) not in self._own[node]:
+                self._own[node].append((len(pattern), payload))
+
+        # breadth-first computation of the failure links
+        queue = deque()
+        for node in self._goto[0].values():
+            self._out[node] = list(self._own[node])
+            queue.append(node)
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                self._out[next_node] = self._own[next_node] + self._out[self._fail[next_node]]
+                queue.append(next_node)
+
+    def _add_hit(self, hits, sentence, start, length, payload):
+        """Keep the longest, then leftmost, hit for the payload."""
+        best = hits.get(payload)
+        if best is None or length > best[1] or (length == best[1] and start < best[0]):
+            hits[payload] = (start, length)
+
+    def find_all(self, sentence, prefix_sentence=None, accept=None):
+        """Find all patterns in the sentence.
+
+        Args:
+            sentence (str): the sentence to search in
+            prefix_sentence (str): an alternative spelling of the sentence (e.g. with
+                lowercased first letter) whose matches starting at position 0 are also reported
+            accept (Callable[[int, int], bool]): only the hits whose (start, end) offsets it accepts
+                are reported (e.g. `ConsumableSentence.is_free`), all hits by default
+
+        Returns:
+            dict: payload -> matched substring of the (original) sentence
+        """
+        hits = {}
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, char in enumerate(sentence):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, payload in out[node]:
+                if accept is None or accept(i - length + 1, i + 1):
+                    self._add_hit(hits, sentence, i - length + 1, length, payload)
+
+        if prefix_sentence is not None and prefix_sentence != sentence:
+            # matches not starting at 0 are the same as in the original sentence
+            node = 0
+            for char in prefix_sentence:
+                node = goto[node].get(char)
+                if node is None:
+                    break
+                for length, payload in self._own[node]:
+                    if accept is None or accept(0, length):
+                        self._add_hit(hits, sentence, 0, length, payload)
+
+        return {payload: sentence[start:start+length] for payload, (start, length) in hits.items()}
+
+class ErrorRecord(namedtuple("ErrorRecord", ["index", "kind", "slot", "value", "substring", "sys_line", "da"])):
+    """A slot error or coverage problem found in one instance. The kind is either
+    "missing" (the `value` of `slot` was not found in the system output),
+    "additional" (the `substring` implies a `slot` value that is not in the DA),
+    or "unchecked" (the `value` of `slot` cannot be checked by the evaluator)."""
+
+    __slots__ = ()
+
+    KINDS = ("missing", "additional", "unchecked")
+
+class ErrorSink:
+    """Receives the error records from the Evaluator. The Evaluator builds the records
+    only for the kinds the sink accepts; this base class accepts none."""
+
+    def accepts(self, kind):
+        return False
+
+    def report(self, record):
+        pass
+
+class ListErrorSink(ErrorSink):
+    """Keeps the error records of the given kinds in memory"""
+
+    def __init__(self, kinds=ErrorRecord.KINDS):
+        self.kinds = frozenset(kinds)
+        self.records = []
+
+    def accepts(self, kind):
+        return kind in self.kinds
+
+    def report(self, record):
+        self.records.append(record)
+
+class JsonlErrorSink(ErrorSink):
+    """Writes the error records of the given kinds to a JSONL file, one record per line"""
+
+    def __init__(self, jsonl_file, kinds=ErrorRecord.KINDS):
+        self.kinds = frozenset(kinds)
+        self.file = open(jsonl_file, "w")
+
+    def accepts(self, kind):
+        return kind in self.kinds
+
+    def report(self, record):
+        self.file.write(json.dumps(record._asdict(), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class LoggingErrorSink(ErrorSink):
+    """Logs the error records: slot errors on the INFO level, coverage problems on the DEBUG level.
+    Records are only built if the root logger is enabled for the corresponding level."""
+
+    LEVELS = {
+        "missing": logging.INFO,
+        "additional": logging.INFO,
+        "unchecked": logging.DEBUG,
+    }
+
+    def accepts(self, kind):
+        return logging.getLogger().isEnabledFor(self.LEVELS[kind])
+
+    def report(self, record):
+        if record.kind == "missing":
+            message = f"Slot Error: didn't find match for '{record.value}' for slot '{record.slot}' in instance {record.index}: '{record.sys_line}'"
+        elif record.kind == "additional":
+            message = f"Slot Error: found substring '{record.substring}' implying slot '{record.slot}' in instance {record.index}: '{record.sys_line}'. DA is '{record.da}'"
+        elif record.value is None:
+            message = f"Coverage problem: We cannot handle {record.slot} with no value."
+        else:
+            message = f"Coverage problem: We cannot handle value '{record.value}' for slot {record.slot}"
+        logging.log(self.LEVELS[record.kind], message)
+
+class CombinedErrorSink(ErrorSink):
+    """Passes the error records to several sinks"""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def accepts(self, kind):
+        return any(sink.accepts(kind) for sink in self.sinks)
+
+    def report(self, record):
+        for sink in self.sinks:
+            if sink.accepts(record.kind):
+                sink.report(record)
+
+class SlotErrorBreakdown(ErrorSink):
+    """Counts the slot values and errors by DA type and by slot, and the confusions of the expected
+    slot values with the values found instead of them, collected in the same pass as the evaluation
+    (see `Evaluator.evaluate`). It receives the error records as an error sink and the per-instance
+    results with the parsed DAs at the end of the evaluation.
+
+    A missing value and an additional value of the same slot in one instance are counted as a confusion
+    of the two values; the remaining missing values are confused with None (not found), the remaining
+    additional values with None (not expected).
+    """
+
+    def __init__(self):
+        # DA type -> counter of "das", "slot_values", "missing", "additional"
+        self.by_da_type = defaultdict(Counter)
+        # slot -> counter of "slot_values", "missing", "additional", "unchecked"
+        self.by_slot = defaultdict(Counter)
+        # (slot, expected value, found value) -> count
+        self.confusions = Counter()
+        # index -> missing and additional records of the instance, until `add_instances`
+        self.instance_records = defaultdict(list)
+
+    def accepts(self, kind):
+        return True
+
+    def report(self, record):
+        if record.kind == "unchecked":
+            # several kids_allowed values are reported together, joined by " or "
+            num_values = len(record.value.split(" or ")) if record.slot == "kids_allowed" and record.value else 1
+            self.by_slot[record.slot]["unchecked"] += num_values
+        else:
+            self.by_slot[record.slot][record.kind] += 1
+            self.instance_records[record.index].append(record)
+
+    def add_instances(self, prepared_das, instance_results):
+        """Adds the parsed DAs and the results of the evaluated instances"""
+        for prepared_da, instance_result in zip(prepared_das, instance_results):
+            counts = self.by_da_type[prepared_da.da.type]
+            counts["das"] += 1
+            counts["slot_values"] += instance_result.num_slot_values
+            counts["missing"] += instance_result.num_missing_slot_value_error
+            counts["additional"] += instance_result.num_additional_slot_value_error
+            for slot, values in prepared_da.attributes.items():
+                # we count the empty slots as one value
+                self.by_slot[slot]["slot_values"] += len(values) or 1
+                if slot == "type" and values:
+                    # the type slots are not checked, but they are not reported as unchecked values
+                    self.by_slot[slot]["unchecked"] += 1
+
+        for index in sorted(self.instance_records):
+            missing, additional = defaultdict(list), defaultdict(list)
+            for record in self.instance_records[index]:
+                if record.kind == "missing":
+                    missing[record.slot].append(record.value)
+                else:
+                    # additional kids_allowed mentions do not have a value
+                    additional[record.slot].append(record.value if record.value is not None else record.substring)
+            for slot in list(missing) + [slot for slot in additional if slot not in missing]:
+                for expected, found in zip_longest(missing[slot], additional[slot]):
+                    self.confusions[slot, expected, found] += 1
+        self.instance_records.clear()
+
+    @staticmethod
+    def with_ser(counts):
+        counts = dict(counts)
+        slot_errors = counts.get("missing", 0) + counts.get("additional", 0)
+        counts["ser"] = slot_errors / counts["slot_values"] if counts.get("slot_values") else 0
+        return counts
+
+    def to_dict(self):
+        """Returns the breakdown as a JSON serializable dictionary"""
+        return {
+            "da_types": {da_type: self.with_ser(counts) for da_type, counts in sorted(self.by_da_type.items())},
+            "slots": {slot: self.with_ser(counts) for slot, counts in sorted(self.by_slot.items())},
+            "confusions": [
+                {"slot": slot, "expected": expected, "found": found, "count": count}
+                for (slot, expected, found), count in self.confusions.most_common()
+            ],
+        }
+
+    def print_tables(self, file=None):
+        """Prints the breakdown as tables"""
+        breakdown = self.to_dict()
+        for title, rows, columns in [("DA type", breakdown["da_types"], ["das", "slot_values", "missing", "additional"]),
+                                     ("Slot", breakdown["slots"], ["slot_values", "missing", "additional", "unchecked"])]:
+            name_width = max([len(title)] + [len(name) for name in rows])
+            print(f"{title:<{name_width}}  " + "  ".join(f"{column:>11}" for column in columns) + f"  {'SER':>8}", file=file)
+            for name, counts in rows.items():
+                print(f"{name:<{name_width}}  " + "  ".join(f"{counts.get(column, 0):>11}" for column in columns) + f"  {counts['ser']:>8.4f}", file=file)
+            print(file=file)
+        print(f"{'Slot':<16}  {'Expected':<30}  {'Found':<30}  {'Count':>6}", file=file)
+        for confusion in breakdown["confusions"]:
+            print(f"{confusion['slot']:<16}  {str(confusion['expected']):<30}  {str(confusion['found']):<30}  {confusion['count']:>6}", file=file)
+
+class EvaluationProfiler:
+    """Collects the call counts and the cumulative wall time of the slot handlers and the
+    evaluation phases, and keeps the slowest instances. It is installed by `Evaluator.enable_profiling`,
+    which replaces the profiled methods of the evaluator by timing wrappers, so the evaluation
+    does not pay anything for the profiling when it is disabled.
+
+    The times are inclusive, e.g. `surface_forms_match` is also counted inside `count_additional_errors`.
+    """
+
+    # Profiled methods of the evaluator; `evaluate_one` is the time of whole instances
+    METHODS = ("evaluate_one", "handle_kids_allowed", "handle_price", "address_match", "exact_match",
+               "surface_forms_match", "find_kids_negation", "remove_from_sentence", "count_additional_errors")
+
+    def __init__(self, num_slowest=10):
+        """
+        Args:
+            num_slowest (int): number of the slowest instances to keep
+        """
+        self.num_slowest = num_slowest
+        self.calls = Counter()
+        self.times = defaultdict(float)
+        # min-heap of (seconds, index, DA line, system output line)
+        self.slowest = []
+
+    def wrap(self, name, method):
+        """Returns a wrapper of the (bound) method that times its calls"""
+        calls, times, timer = self.calls, self.times, time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[name] += timer() - start
+                calls[name] += 1
+        return wrapper
+
+    def wrap_instance(self, method):
+        """Returns a wrapper of `Evaluator.evaluate_one` that also keeps the slowest instances"""
+        calls, times, timer, slowest = self.calls, self.times, time.perf_counter, self.slowest
+
+        def wrapper(da, sys_line, index=0):
+            start = timer()
+            result = method(da, sys_line, index)
+            elapsed = timer() - start
+            times["evaluate_one"] += elapsed
+            calls["evaluate_one"] += 1
+            if len(slowest) < self.num_slowest:
+                heapq.heappush(slowest, (elapsed, index, da.line if isinstance(da, PreparedDA) else da, sys_line))
+            elif self.num_slowest and elapsed > slowest[0][0]:
+                heapq.heapreplace(slowest, (elapsed, index, da.line if isinstance(da, PreparedDA) else da, sys_line))
+            return result
+        return wrapper
+
+    def print_summary(self, file=stderr):
+        """Prints the table of the profiled methods and the slowest instances"""
+        name_width = max(len(name) for name in self.METHODS)
+        print(f"{'Method':<{name_width}}  {'Calls':>8}  {'Total [ms]':>10}  {'Per call [us]':>13}", file=file)
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            total, calls = self.times[name], self.calls[name]
+            print(f"{name:<{name_width}}  {calls:>8}  {total * 1000:>10.2f}  {total / calls * 1e6:>13.2f}", file=file)
+        if self.slowest:
+            print("Slowest instances:", file=file)
+            for elapsed, index, da_line, sys_line in sorted(self.slowest, reverse=True):
+                print(f"{elapsed * 1e6:>10.2f} us  #{index}  {da_line}  {sys_line}", file=file)
+
 class Evaluator:
     """Main class for running the Slot Error Rate evaluation"""
 
-    def __init__(self, surface_forms):
+    def __init__(self, surface_forms, error_sink=None, deduplicate=True):
+        """
+        Args:
+            surface_forms (dict or Lexicon): surface forms for all slot values, as loaded from the JSON file,
+                or the lexicon, whose forms are split only once
+            error_sink (ErrorSink): receives the found errors, logs them by default
+            deduplicate (bool): evaluate identical (DA, system output) pairs only once (see `count_errors`)
+        """
+        self.error_sink = error_sink if error_sink is not None else LoggingErrorSink()
+        self.deduplicate = deduplicate
+        self.update_error_reporting()
+        self.profiler = None
         # Main counters for the resulting SER
         self.num_valid_slot_values = 0
         self.num_missing_slot_value_error = 0
@@ -116,19 +1128,37 @@ class Evaluator:
         self.num_cannot_check_slot_values = 0
 
         # Remove the lemma and tags in the surface forms
-        self.surface_forms = {slot: {lemma: [form.split("\t")[1] for form in forms] for lemma, forms in values.items()} for slot, values in surface_forms.items()}
+        if isinstance(surface_forms, Lexicon):
+            self.surface_forms = surface_forms.forms
+        else:
+            self.surface_forms = {slot: {lemma: [form.split("\t")[1] for form in forms] for lemma, forms in values.items()} for slot, values in surface_forms.items()}
         self.kids_surface_forms = ["děti", "dětí", "dětem", "dětmi"]
+        # Forms with their capitalized variants, in the order in which we try to match them
+        self.surface_form_variants = {slot: {value: surface_form_variants(forms) for value, forms in values.items()} for slot, values in self.surface_forms.items()}
+        self.kids_surface_form_variants = surface_form_variants(self.kids_surface_forms)
+        # Negation scanners, one for each maximum word distance
+        self.kids_negation_scanners = {}
         if "price" in self.surface_forms:
             self.price_surface_forms = self.surface_forms["price"]["between _ and _ Kč"]
         else:
             self.price_surface_forms = []
             logging.error(f"No `price` key in the surface forms file. Please check the surface forms file.")
 
+        # Automaton for finding additional slot values, over all forms and their capitalized variants
+        self.additional_slot_values = [(slot, value) for slot, values in self.surface_forms.items() for value in values]
+        self.additional_slot_automaton = SurfaceFormAutomaton(
+            (variant, value_index)
+            for value_index, (slot, value) in enumerate(self.additional_slot_values)
+            for variant in self.surface_form_variants[slot][value]
+        )
+
     def exact_match(self, sentence, substring):
-        """Search for substring in sentence, if there is match return it.
-        If not, return False."""
+        """Search for substring in sentence (outside the consumed spans and at token boundaries),
+        if there is match return it. If not, return False."""
+        if not isinstance(sentence, ConsumableSentence):
+            sentence = ConsumableSentence(sentence)
         substring = str(substring)
-        if substring in sentence:
+        if sentence.find(substring, uncapitalized=False) >= 0:
             return substring
         else:
             return False
@@ -147,59 +1177,54 @@ class Evaluator:
         if there is match return it. If not, return False."""
         street_name, street_num = street_value.rsplit(" ", 1)
         if street_name in forms:
+            if not isinstance(sentence, ConsumableSentence):
+                sentence = ConsumableSentence(sentence)
             for test_name in forms[street_name]:
                 test_address = f"{test_name} {street_num}"
-                if test_address in sentence:
+                if sentence.find(test_address, uncapitalized=False) >= 0:
                     return test_address
         return False
 
     def surface_forms_match(self, sentence, forms):
         """Search for all forms (and capitalized variants) of a word in a sentence, 
-        if there is match return it. If not, return False."""
-        # We look for some variations in capitalization
-        capitalized_first_letters = [form.title() for form in forms]
-        forms = set(forms + capitalized_first_letters)
-        # We try to match the longest subsequences first
-        forms = sorted(forms, key=len, reverse=True)
+        if there is match return it. If not, return False.
+
+        Args:
+            sentence (str, PreparedSentence or ConsumableSentence): the sentence to search in
+            forms (Tuple[str]): forms with their variants, as returned by `surface_form_variants`
+        """
+        if isinstance(sentence, PreparedSentence):
+            sentence = sentence.text
+        if not isinstance(sentence, ConsumableSentence):
+            sentence = ConsumableSentence(sentence)
 
+        # The longest subsequences are tried first, also in the uncapitalized sentence;
+        # the forms which do not occur at all are skipped without checking the spans
+        text, uncapitalized_sentence = sentence.text, sentence.uncapitalized
         for form in forms:
-            i = sentence.find(form)
-            if i >= 0:
-                return sentence[i:i+len(form)]
-            else:
-                # Try to find the form in uncapitalized sentence
-                uncapitalized_sentence = sentence[0].lower() + sentence[1:]
-                j = uncapitalized_sentence.find(form)
-                if j >= 0:
-                    return sentence[j:j+len(form)]
+            if form in text or uncapitalized_sentence.startswith(form):
+                match = sentence.match(form)
+                if match:
+                    return match
 
         return False
 
     def remove_from_sentence(self, sentence, substring):
-        """Remove a substring from a sentence. Deduplicates whitespaces."""
+        """Remove a substring from a sentence, i.e. mark all its occurrences as consumed,
+        so that they are not matched by the other slots nor counted as additional slot values."""
         if substring:
-            new_sentence = "".join(sentence.split(substring))
-            # Replace multiple spaces with one
-            new_sentence = re.sub(' +',' ',new_sentence)
-            assert new_sentence != sentence, f"didn't find match for substring {substring} in sentence {sentence}"
-            return new_sentence
-        else:
-            return sentence
+            sentence.consume(substring)
+        return sentence
     
     def find_kids_negation(self, sys_line, negation_max_word_distance):
         """Looks for a word combination indicating kids_allowed=no in the input sentence"""
-        negation_max_word_distance = str(negation_max_word_distance)
-        match = self.regex_match(sys_line, r"\b(ne\w*) (?:\w+ ){0,"+negation_max_word_distance+r"}dět\w*", group=1)
-        if not match:
-            # (?!a ) is there because of "... a ..." conjunction
-            match = self.regex_match(sys_line, r"dět\w* (?!a )(?:\w+ ){0,2}(ne\w+)", group=1)
-        if not match:
-            match = self.regex_match(sys_line, r"(zakáz\w*|zákaz\w*) (?:\w+ ){0,"+negation_max_word_distance+r"}dět\w*", group=1)
-        if not match:
-            match = self.regex_match(sys_line, r"dět\w* (?:\w+ ){0,"+negation_max_word_distance+r"}(zakáz\w*|zákaz\w*)", group=1)
-        if not match:
-            match = self.regex_match(sys_line, r"(bez) (?:\w+ ){0,3}dět\w*", group=1)
-        return match
+        if isinstance(sys_line, ConsumableSentence):
+            sys_line = sys_line.remaining()
+        scanner = self.kids_negation_scanners.get(negation_max_word_distance)
+        if scanner is None:
+            scanner = KidsNegationScanner(negation_max_word_distance)
+            self.kids_negation_scanners[negation_max_word_distance] = scanner
+        return scanner.find(sys_line)
     
     def count_slot_missing_error(self, is_valid):
         """Adds to the total number of slot values and possibly to the number of errors"""
@@ -207,27 +1232,39 @@ class Evaluator:
         if not is_valid:
             self.num_missing_slot_value_error += 1
     
+    def update_error_reporting(self):
+        """Checks which kinds of errors the error sink accepts. The records of the other kinds
+        are not even built, so that a disabled sink does not cost anything.
+        This is done at the start of each evaluation; call it after changing the sink
+        (or the logging level) when using `evaluate_one` directly."""
+        self.report_missing = self.error_sink.accepts("missing")
+        self.report_additional = self.error_sink.accepts("additional")
+        self.report_unchecked = self.error_sink.accepts("unchecked")
+
     def log_slot_missing_error(self, is_valid, value, slot, sys_line, index):
         if not is_valid:
-            logging.info(f"Slot Error: didn't find match for '{value}' for slot '{slot}' in instance {index}: '{sys_line}'")
+            self.error_sink.report(ErrorRecord(index, "missing", slot, value, None, sys_line, self.current_da_line))
     
-    def log_additional_slot_error(self, substring, slot, sys_line, da_line, index):
-        logging.info(f"Slot Error: found substring '{substring}' implying slot '{slot}' in instance {index}: '{sys_line}'. DA is '{da_line}'")
+    def log_additional_slot_error(self, substring, slot, sys_line, da_line, index, value=None):
+        self.error_sink.report(ErrorRecord(index, "additional", slot, value, substring, sys_line, da_line))
+
+    def log_coverage_problem(self, slot, value, sys_line, index):
+        self.error_sink.report(ErrorRecord(index, "unchecked", slot, value, None, sys_line, self.current_da_line))
 
     def handle_kids_allowed(self, values, sys_line, da, slot, sys_line_orig, index):
         """Subroutine for the evaluate function, checks the kids_allowed slot"""
-        match_kids_slot = self.surface_forms_match(sys_line, self.kids_surface_forms)
+        match_kids_slot = self.surface_forms_match(sys_line, self.kids_surface_form_variants)
 
         # For two examples in the train set the value is missing but =yes is assumed
         if len(values) == 0:
-            values = ["yes"]
+            values = ("yes",)
 
         if len(values) == 1:
             value = values[0]
             negation_max_word_distance = 5
             # inform_no_match will very probably contain a negation
             # therefore we need to check smaller neighbourhood around "děti"
-            if da["type"] == "inform_no_match":
+            if da.type == "inform_no_match":
                 negation_max_word_distance = 3
             if value == "yes":
                 match_kids_negation = self.find_kids_negation(sys_line, negation_max_word_distance)
@@ -237,7 +1274,8 @@ class Evaluator:
                 self.count_slot_missing_error(is_valid)
                 if is_valid:
                     sys_line = self.remove_from_sentence(sys_line, match_kids_slot)
-                self.log_slot_missing_error(is_valid, value, slot, sys_line_orig, index)
+                if self.report_missing:
+                    self.log_slot_missing_error(is_valid, value, slot, sys_line_orig, index)
             elif value == "no":
                 match_kids_negation = self.find_kids_negation(sys_line, negation_max_word_distance)
                 # the sentence needs to contain the word kids
@@ -247,23 +1285,28 @@ class Evaluator:
                 if is_valid:
                     sys_line = self.remove_from_sentence(sys_line, match_kids_slot)
                     sys_line = self.remove_from_sentence(sys_line, match_kids_negation)
-                self.log_slot_missing_error(is_valid, value, slot, sys_line_orig, index)
+                if self.report_missing:
+                    self.log_slot_missing_error(is_valid, value, slot, sys_line_orig, index)
             elif value == "dont_care":
                 self.num_cannot_check_slot_values += 1
-                logging.debug(f"Coverage problem: We cannot handle kids_allowed='dont_care'")
+                if self.report_unchecked:
+                    self.log_coverage_problem(slot, value, sys_line_orig, index)
             elif value == "none":
                 self.num_cannot_check_slot_values += 1
-                logging.debug(f"Coverage problem: We cannot handle kids_allowed='none'")
+                if self.report_unchecked:
+                    self.log_coverage_problem(slot, value, sys_line_orig, index)
             else:
                 assert False, f"Invalid value {value} for kids_allowed"
 
         if len(values) == 2:
             if set(values) == {"yes", "no"}:
                 self.num_cannot_check_slot_values += 2
-                logging.debug(f"Coverage problem: We cannot handle kids_allowed='yes or no'")
+                if self.report_unchecked:
+                    self.log_coverage_problem(slot, " or ".join(values), sys_line_orig, index)
             elif set(values) == {"dont_care", "yes"}:
                 self.num_cannot_check_slot_values += 2
-                logging.debug(f"Coverage problem: We cannot handle kids_allowed='yes',kids_allowed='dont_care'")
+                if self.report_unchecked:
+                    self.log_coverage_problem(slot, " or ".join(values), sys_line_orig, index)
             else:
                 assert False, f"Invalid value {values} for kids_allowed"
         
@@ -289,140 +1332,662 @@ class Evaluator:
             
             self.count_slot_missing_error(match)
             sys_line = self.remove_from_sentence(sys_line, match)
-            self.log_slot_missing_error(match, value, slot, sys_line_orig, index)
+            if self.report_missing:
+                self.log_slot_missing_error(match, value, slot, sys_line_orig, index)
         return sys_line
 
-    def evaluate(self, das, sys):
+    def evaluate(self, das, sys, jobs=1, per_instance=False, breakdown=None):
         """Computes the Slot Error Rate.
 
         Args:
             das (List[str]): Dialogue Act lines
             sys (List[str]): System output lines
+            jobs (int): number of worker processes to use
+            per_instance (bool): return also the per-instance `InstanceArrays`
+            breakdown (SlotErrorBreakdown): collects the counts by DA type, slot and value in the same pass
+
+        Returns:
+            tuple: SER, slot errors, missing slot errors, additional slot errors;
+                with per_instance a pair of this tuple and the `InstanceArrays`
         """
-        self.num_cannot_check_slot_values = 0
-        num_total_num_of_slot_values = 0
+        return self.evaluate_prepared([PreparedDA.from_line(da_line) for da_line in das], sys, jobs, per_instance, breakdown)
+
+    def evaluate_many(self, das, systems, jobs=1, per_instance=False):
+        """Computes the Slot Error Rate for several system outputs against the same references.
+        Each DA is parsed only once.
+
+        Args:
+            das (List[str]): Dialogue Act lines
+            systems (Dict[str, List[str]]): System output lines for each system name
+            jobs (int): number of worker processes to use
+            per_instance (bool): return also the per-instance `InstanceArrays` of each system
+
+        Returns:
+            dict: system name -> (SER, slot errors, missing slot errors, additional slot errors),
+                with per_instance system name -> pair of this tuple and the `InstanceArrays`
+        """
+        prepared_das = [PreparedDA.from_line(da_line) for da_line in das]
+        results = {}
+
+        def add_result(name, accumulator):
+            results[name] = (self.summarize(accumulator), accumulator.instance_arrays()) if per_instance else self.summarize(accumulator)
+
+        if jobs > 1:
+            with self.worker_pool(jobs) as pool:
+                for name, sys in systems.items():
+                    logging.info(f"Evaluating system {name}")
+                    add_result(name, self.count_errors_parallel(pool, jobs, prepared_das, sys, per_instance))
+        else:
+            for name, sys in systems.items():
+                logging.info(f"Evaluating system {name}")
+                add_result(name, self.count_errors(prepared_das, sys, keep_instance_results=per_instance))
+        return results
+
+    def evaluate_prepared(self, prepared_das, sys, jobs=1, per_instance=False, breakdown=None):
+        """Computes the Slot Error Rate for already parsed DAs.
+
+        Args:
+            prepared_das (List[PreparedDA]): parsed Dialogue Acts
+            sys (List[str]): System output lines
+            jobs (int): number of worker processes to use
+            per_instance (bool): return also the per-instance `InstanceArrays`
+            breakdown (SlotErrorBreakdown): collects the counts by DA type, slot and value in the same pass
+        """
+        keep_instance_results = per_instance or breakdown is not None
+        error_sink = self.error_sink
+        if breakdown is not None:
+            self.error_sink = CombinedErrorSink([error_sink, breakdown])
+        try:
+            if jobs > 1:
+                with self.worker_pool(jobs) as pool:
+                    accumulator = self.count_errors_parallel(pool, jobs, prepared_das, sys, keep_instance_results)
+            else:
+                accumulator = self.count_errors(prepared_das, sys, keep_instance_results=keep_instance_results)
+        finally:
+            self.error_sink = error_sink
+        if breakdown is not None:
+            breakdown.add_instances(prepared_das, accumulator.instance_results)
+        result = self.summarize(accumulator)
+        if per_instance:
+            return result, accumulator.instance_arrays()
+        return result
+
+    def evaluate_stream(self, das, sys, report_every=0, report=None):
+        """Computes the Slot Error Rate, reading the DAs and system outputs lazily in lockstep,
+        so that the memory use does not grow with the data (e.g. when reading a pipe).
+
+        Args:
+            das (Iterable[str]): Dialogue Act lines
+            sys (Iterable[str]): System output lines
+            report_every (int): call `report` after each `report_every` instances (0 for never)
+            report (Callable[[SlotErrorCounts], None]): function receiving the running counters
+        """
+        self.update_error_reporting()
+        accumulator = SlotErrorAccumulator()
+        missing = object()
+        for index, (da_line, sys_line) in enumerate(zip_longest(das, sys, fillvalue=missing)):
+            assert da_line is not missing and sys_line is not missing, f"Number of references and system outputs must match (one of them ended after {index} lines)"
+            accumulator.add(self.evaluate_one(da_line, sys_line, index))
+            if report and report_every and (index + 1) % report_every == 0:
+                report(accumulator.counts)
+        return self.summarize(accumulator)
+
+    def enable_profiling(self, profiler=None):
+        """Starts timing the slot handlers and the evaluation phases.
+
+        Args:
+            profiler (EvaluationProfiler): collects the timings, a new one is created by default
+
+        Returns:
+            EvaluationProfiler: the profiler
+        """
+        self.disable_profiling()
+        self.profiler = profiler if profiler is not None else EvaluationProfiler()
+        for name in EvaluationProfiler.METHODS:
+            if name == "evaluate_one":
+                setattr(self, name, self.profiler.wrap_instance(self.evaluate_one))
+            else:
+                setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        return self.profiler
+
+    def disable_profiling(self):
+        """Removes the timing wrappers installed by `enable_profiling`"""
+        if self.profiler is None:
+            return
+        for name in EvaluationProfiler.METHODS:
+            del self.__dict__[name]
+        self.profiler = None
+
+    def worker_copy(self):
+        """Returns a copy of this evaluator for evaluating a part of the data in another process or thread.
+        The copy collects the error records accepted by the error sink, so that they can be
+        sent back and reported by this evaluator in the input order."""
+        assert self.profiler is None, "Profiling is only supported when evaluating in a single process"
+        worker_evaluator = copy.copy(self)
+        worker_evaluator.error_sink = ListErrorSink([kind for kind in ErrorRecord.KINDS if self.error_sink.accepts(kind)])
+        return worker_evaluator
+
+    def worker_pool(self, jobs):
+        """Creates a pool of processes, each with its own copy of this evaluator (see `worker_copy`)."""
+        return multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(self.worker_copy(),))
+
+    def process_executor(self, jobs):
+        """Creates a `concurrent.futures` pool of processes, each with its own copy of this evaluator,
+        to be used by `AsyncEvaluator`."""
+        return concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(self.worker_copy(),))
+
+    def count_errors_parallel(self, pool, jobs, prepared_das, sys, keep_instance_results=False):
+        """Splits the (DA, system output) pairs into shards, counts the errors
+        in the worker processes and merges the accumulators."""
+        pairs = list(zip(prepared_das, sys))
+        shard_size = max(1, math.ceil(len(pairs) / (jobs * 4)))
+        shards = [(start, pairs[start:start+shard_size], keep_instance_results) for start in range(0, len(pairs), shard_size)]
+        accumulator = SlotErrorAccumulator(keep_instance_results)
+        for shard_accumulator, records in pool.imap(_count_errors_in_worker, shards):
+            accumulator.merge(shard_accumulator)
+            for record in records:
+                self.error_sink.report(record)
+        return accumulator
+
+    def count_errors(self, prepared_das, sys, start_index=0, keep_instance_results=False):
+        """Counts the slot errors for already parsed DAs.
+
+        Args:
+            prepared_das (List[PreparedDA]): parsed Dialogue Acts
+            sys (List[str]): System output lines
+            start_index (int): index of the first instance (used for logging)
+            keep_instance_results (bool): keep the per-instance results in the accumulator
+
+        Returns:
+            SlotErrorAccumulator: the counters
+        """
+        self.update_error_reporting()
+        accumulator = SlotErrorAccumulator(keep_instance_results)
+        if not self.deduplicate:
+            for index, (prepared_da, sys_line) in enumerate(zip(prepared_das, sys), start_index):
+                accumulator.add(self.evaluate_one(prepared_da, sys_line, index))
+            return accumulator
+
+        # Identical (DA, system output) pairs are evaluated only once, their errors are reported again
+        # for each of them, so the errors of each evaluated pair are collected first
+        error_sink = self.error_sink
+        reporting = self.report_missing or self.report_additional or self.report_unchecked
+        if reporting:
+            self.error_sink = ListErrorSink([kind for kind in ErrorRecord.KINDS if error_sink.accepts(kind)])
+        evaluated = {}
+        try:
+            for index, (prepared_da, sys_line) in enumerate(zip(prepared_das, sys), start_index):
+                key = (prepared_da.line if isinstance(prepared_da, PreparedDA) else prepared_da, sys_line)
+                if key in evaluated:
+                    instance_result, records = evaluated[key]
+                    accumulator.add(instance_result, evaluated=False)
+                    for record in records:
+                        error_sink.report(record._replace(index=index))
+                    continue
+
+                instance_result = self.evaluate_one(prepared_da, sys_line, index)
+                records = ()
+                if reporting:
+                    records = self.error_sink.records
+                    self.error_sink.records = []
+                    for record in records:
+                        error_sink.report(record)
+                evaluated[key] = (instance_result, records)
+                accumulator.add(instance_result)
+        finally:
+            self.error_sink = error_sink
+        return accumulator
+
+    def score_nbest(self, da, hypotheses, index=0):
+        """Evaluates all hypotheses of an n-best list for one DA, which is parsed only once.
+        Identical hypotheses are evaluated (and their errors reported) only once.
+
+        Args:
+            da (str or PreparedDA): Dialogue Act line, or the already parsed DA
+            hypotheses (List[str]): System output lines
+            index (int): index of the DA (used for logging)
+
+        Returns:
+            List[InstanceResult]: the result of each hypothesis
+        """
+        if not isinstance(da, PreparedDA):
+            da = PreparedDA.from_line(da)
+        evaluated = {}
+        for hypothesis in hypotheses:
+            if hypothesis not in evaluated:
+                evaluated[hypothesis] = self.evaluate_one(da, hypothesis, index)
+        return [evaluated[hypothesis] for hypothesis in hypotheses]
+
+    def evaluate_nbest(self, das, nbest_lists):
+        """Evaluates the n-best lists of system outputs.
+
+        Args:
+            das (List[str]): Dialogue Act lines
+            nbest_lists (List[List[str]]): System output lines for each DA
+
+        Returns:
+            List[List[InstanceResult]]: the result of each hypothesis for each DA
+        """
+        assert len(das) == len(nbest_lists), f"Number of references and n-best lists must match ({len(das)} != {len(nbest_lists)})"
+        self.update_error_reporting()
+        return [self.score_nbest(da_line, hypotheses, index) for index, (da_line, hypotheses) in enumerate(zip(das, nbest_lists))]
+
+    def evaluate_one(self, da, sys_line, index=0):
+        """Evaluates one system output.
+
+        Args:
+            da (str or PreparedDA): Dialogue Act line, or the already parsed DA
+            sys_line (str): System output line
+            index (int): index of the instance (used for logging)
+
+        Returns:
+            InstanceResult: the numbers of slot values and errors in this instance
+        """
+        if not isinstance(da, PreparedDA):
+            da = PreparedDA.from_line(da)
+        da_line, da, attributes, attribute_list, num_slot_values = da
+        sys_line_orig = sys_line
+        sys_line = ConsumableSentence(sys_line)
         num_type_slots = 0
+        self.current_da_line = da_line
 
+        # Counters of the current instance, updated by the slot handlers
         self.num_valid_slot_values = 0
         self.num_missing_slot_value_error = 0
         self.num_additional_slot_value_error = 0
+        self.num_cannot_check_slot_values = 0
 
-        for index, (da_line, sys_line_orig) in enumerate(zip(das, sys)):
-            sys_line = sys_line_orig
-            da = parse_da(da_line)
-            attributes = da["attributes"]
-
-            num_total_num_of_slot_values += sum(len(values) for _, values in attributes.items())
-            # we count the empty slots as one value
-            num_total_num_of_slot_values += sum(len(values) == 0 for _, values in attributes.items())
-
-            attribute_priorities = {
-                "kids_allowed": 10
-            }
-            attribute_list = [(slot, values, attribute_priorities[slot] if slot in attribute_priorities else 99) for slot, values in attributes.items()]
-            attribute_list = sorted(attribute_list, key=lambda x: x[2])
-            for slot, values, _ in attribute_list:
-                # We cannot handle slots with no values, we log the number of these unhandled cases
-                # The only slot that we can handle with no value is the kids_allowed
-                if slot != "kids_allowed" and values == []:
-                    # we count missing values as one slot value
-                    self.num_cannot_check_slot_values += 1
-                    logging.debug(f"Coverage problem: We cannot handle {slot} with no value.")
-                    continue
-                
-                # Big switch statement for handling different slot types
-                if slot == "type":
-                    num_type_slots += 1
-                    self.num_cannot_check_slot_values += 1
-                    # We don't log the coverage problem here because we don't have to check this slot
-                    continue
-                elif slot == "kids_allowed":
-                    sys_line = self.handle_kids_allowed(values, sys_line, da, slot, sys_line_orig, index)
-                elif slot in ["phone", "count", "postcode"]:
-                    # TODO: For count we might want to implement checking numerals (such as "dvě", "tři", ...)
-                    for value in values:
-                        match = self.exact_match(sys_line, value)
-                        self.count_slot_missing_error(match)
-                        sys_line = self.remove_from_sentence(sys_line, match)
+        for slot, values, _ in attribute_list:
+            # We cannot handle slots with no values, we log the number of these unhandled cases
+            # The only slot that we can handle with no value is the kids_allowed
+            if slot != "kids_allowed" and values == ():
+                # we count missing values as one slot value
+                self.num_cannot_check_slot_values += 1
+                if self.report_unchecked:
+                    self.log_coverage_problem(slot, None, sys_line_orig, index)
+                continue
+            
+            # Big switch statement for handling different slot types
+            if slot == "type":
+                num_type_slots += 1
+                self.num_cannot_check_slot_values += 1
+                # We don't log the coverage problem here because we don't have to check this slot
+                continue
+            elif slot == "kids_allowed":
+                sys_line = self.handle_kids_allowed(values, sys_line, da, slot, sys_line_orig, index)
+            elif slot in ["phone", "count", "postcode"]:
+                # TODO: For count we might want to implement checking numerals (such as "dvě", "tři", ...)
+                for value in values:
+                    match = self.exact_match(sys_line, value)
+                    self.count_slot_missing_error(match)
+                    sys_line = self.remove_from_sentence(sys_line, match)
+                    if self.report_missing:
+                        self.log_slot_missing_error(match, value, slot, sys_line_orig, index)
+            elif slot == "address":
+                for value in values:
+                    match = self.address_match(value, sys_line, self.surface_forms["street"])
+                    self.count_slot_missing_error(match)
+                    sys_line = self.remove_from_sentence(sys_line, match)
+                    if self.report_missing:
                         self.log_slot_missing_error(match, value, slot, sys_line_orig, index)
-                elif slot == "address":
-                    for value in values:
-                        match = self.address_match(value, sys_line, self.surface_forms["street"])
+            elif slot == "price":
+                sys_line = self.handle_price(values, sys_line, da, slot, sys_line_orig, index)
+            elif slot in self.surface_forms:
+                for value in values:
+                    if value in self.surface_forms[slot]:
+                        match = self.surface_forms_match(sys_line, self.surface_form_variants[slot][value])
                         self.count_slot_missing_error(match)
                         sys_line = self.remove_from_sentence(sys_line, match)
-                        self.log_slot_missing_error(match, value, slot, sys_line_orig, index)
-                elif slot == "price":
-                    sys_line = self.handle_price(values, sys_line, da, slot, sys_line_orig, index)
-                elif slot in self.surface_forms:
-                    for value in values:
-                        if value in self.surface_forms[slot]:
-                            match = self.surface_forms_match(sys_line, self.surface_forms[slot][value])
-                            self.count_slot_missing_error(match)
-                            sys_line = self.remove_from_sentence(sys_line, match)
+                        if self.report_missing:
                             self.log_slot_missing_error(match, value, slot, sys_line_orig, index)
-                        else:
-                            # TODO: handle dont_care
-                            if value == "dont_care":
-                                self.num_cannot_check_slot_values += 1
-                                logging.debug(f"Coverage problem: We cannot handle value 'dont_care' for slot {slot}")
-                            # TODO: handle none
-                            if value == "none":
-                                self.num_cannot_check_slot_values += 1
-                                logging.debug(f"Coverage problem: We cannot handle value 'none' for slot {slot}")
-                else:
-                    logging.error(f"Invalid slot in the parsed attributes of DA '{da_line}': {slot}")
-                    pass
-            
-            
-            # Find additional slot values that are not supposed to be in the system output
-            for surface_forms_slot, surface_forms_values in self.surface_forms.items():
-                # Do not check those slots that are inside the DA without any value
-                # These often list some or all of the value keywords to raise a question to the user
-                if surface_forms_slot in attributes and attributes[surface_forms_slot] == []:
-                    continue
-                # Do not check the good_for_meal slot for DA goodbye().
-                # To avoid false additional error in sentences such as "Přeji dobrou chuť k večeři ."
-                if da["type"] == "goodbye" and surface_forms_slot == "good_for_meal":
-                    continue
+                    else:
+                        # TODO: handle dont_care
+                        if value == "dont_care":
+                            self.num_cannot_check_slot_values += 1
+                            if self.report_unchecked:
+                                self.log_coverage_problem(slot, value, sys_line_orig, index)
+                        # TODO: handle none
+                        if value == "none":
+                            self.num_cannot_check_slot_values += 1
+                            if self.report_unchecked:
+                                self.log_coverage_problem(slot, value, sys_line_orig, index)
+            else:
+                logging.error(f"Invalid slot in the parsed attributes of DA '{da_line}': {slot}")
+                pass
+        
+        
+        self.count_additional_errors(sys_line, da, attributes, sys_line_orig, da_line, index)
 
-                if surface_forms_slot == "price_range":
-                    continue
-                for forms in surface_forms_values.values():
-                    match = self.surface_forms_match(sys_line, forms)
-                    if match:
-                        self.log_additional_slot_error(match, surface_forms_slot, sys_line_orig, da_line, index)
-                        self.num_additional_slot_value_error += 1
+        return InstanceResult(
+            num_slot_values=num_slot_values,
+            num_valid_slot_values=self.num_valid_slot_values,
+            num_missing_slot_value_error=self.num_missing_slot_value_error,
+            num_additional_slot_value_error=self.num_additional_slot_value_error,
+            num_cannot_check_slot_values=self.num_cannot_check_slot_values,
+            num_type_slots=num_type_slots,
+        )
+
+    def count_additional_errors(self, sys_line, da, attributes, sys_line_orig, da_line, index):
+        """Counts the slot values that are in the system output but not in the DA.
 
-            # Find additional kids_allowed slot
-            match_kids_slot = self.surface_forms_match(sys_line, self.kids_surface_forms)
-            if match_kids_slot and ("kids_allowed" not in attributes or attributes["kids_allowed"] in [["yes"], ["no"]]):
+        Args:
+            sys_line (ConsumableSentence): System output line with the matched slot values consumed
+            da (ParsedDA): parsed Dialogue Act
+            attributes (dict): slot values of the DA
+            sys_line_orig (str): original System output line (used for logging)
+            da_line (str): Dialogue Act line (used for logging)
+            index (int): index of the instance (used for logging)
+        """
+        # Find additional slot values that are not supposed to be in the system output
+        if not isinstance(sys_line, ConsumableSentence):
+            sys_line = ConsumableSentence(sys_line)
+        additional_matches = self.additional_slot_automaton.find_all(sys_line.text, sys_line.uncapitalized, sys_line.is_free)
+        for value_index in sorted(additional_matches):
+            surface_forms_slot = self.additional_slot_values[value_index][0]
+            # Do not check those slots that are inside the DA without any value
+            # These often list some or all of the value keywords to raise a question to the user
+            if surface_forms_slot in attributes and attributes[surface_forms_slot] == ():
+                continue
+            # Do not check the good_for_meal slot for DA goodbye().
+            # To avoid false additional error in sentences such as "Přeji dobrou chuť k večeři ."
+            if da.type == "goodbye" and surface_forms_slot == "good_for_meal":
+                continue
+
+            if surface_forms_slot == "price_range":
+                continue
+            if self.report_additional:
+                self.log_additional_slot_error(additional_matches[value_index], surface_forms_slot, sys_line_orig, da_line, index, self.additional_slot_values[value_index][1])
+            self.num_additional_slot_value_error += 1
+
+        # Find additional kids_allowed slot
+        match_kids_slot = self.surface_forms_match(sys_line, self.kids_surface_form_variants)
+        if match_kids_slot and ("kids_allowed" not in attributes or attributes["kids_allowed"] in [("yes",), ("no",)]):
+            if self.report_additional:
                 self.log_additional_slot_error(match_kids_slot, "kids_allowed", sys_line_orig, da_line, index)
-                self.num_additional_slot_value_error += 1
+            self.num_additional_slot_value_error += 1
 
-        logging.info(f"Total number of DAs: {len(das)}")
+    def summarize(self, accumulator):
+        """Checks the coverage of the (merged) counters and computes the Slot Error Rate.
 
-        diff_cannot_check = num_total_num_of_slot_values - self.num_valid_slot_values
-        assert self.num_cannot_check_slot_values == diff_cannot_check, "The number of slots we know we cannot check should equal the total number of slots and the number of slots that we correctly handled"
+        Args:
+            accumulator (SlotErrorAccumulator): the counters
+
+        Returns:
+            tuple: SER, slot errors, missing slot errors, additional slot errors
+        """
+        self.num_valid_slot_values = accumulator.num_valid_slot_values
+        self.num_missing_slot_value_error = accumulator.num_missing_slot_value_error
+        self.num_additional_slot_value_error = accumulator.num_additional_slot_value_error
+        self.num_cannot_check_slot_values = accumulator.num_cannot_check_slot_values
+
+        return summarize_counts(accumulator)
+
+def summarize_counts(accumulator):
+    """Logs the totals of the accumulator and computes the Slot Error Rate, see `Evaluator.summarize`"""
+    logging.info(f"Total number of DAs: {accumulator.num_das}")
+    if accumulator.num_evaluated != accumulator.num_das:
+        logging.info(f"Evaluated unique (DA, output) pairs: {accumulator.num_evaluated}, dedup ratio {accumulator.dedup_ratio:.2f}")
+    result = accumulator.result()
+    logging.info(f"Total number of slots: {accumulator.num_slot_values}")
+    logging.info(f"Slots that we cannot check: {accumulator.num_cannot_check_slot_values}, out of which {accumulator.num_type_slots} are 'type=restaurant' slots")
+    if not accumulator.num_slot_values:
+        logging.warning(f"Didn't find any valid slots")
+
+    return result
+
+def rerank_nbest(nbest_results):
+    """Selects the hypothesis with the fewest slot errors from each n-best list,
+    the one ranked higher by the decoder if there are more of them.
+
+    Args:
+        nbest_results (List[List[InstanceResult]]): as returned by `Evaluator.evaluate_nbest`
+
+    Returns:
+        List[int]: index of the selected hypothesis in each n-best list
+    """
+    return [min(range(len(results)), key=lambda rank: (results[rank].slot_errors, rank)) for results in nbest_results]
+
+# Evaluator of the worker process, see `Evaluator.worker_pool`
+_worker_evaluator = None
+
+def _init_worker(evaluator):
+    global _worker_evaluator
+    _worker_evaluator = evaluator
+
+def _count_errors_in_worker(shard):
+    return _count_errors_in_shard(_worker_evaluator, shard)
+
+def _count_errors_in_copy(evaluator, shard):
+    return _count_errors_in_shard(evaluator.worker_copy(), shard)
+
+def _count_errors_in_shard(worker_evaluator, shard):
+    start_index, pairs, keep_instance_results = shard
+    prepared_das = [prepared_da for prepared_da, _ in pairs]
+    sys = [sys_line for _, sys_line in pairs]
+    accumulator = worker_evaluator.count_errors(prepared_das, sys, start_index, keep_instance_results)
+    records = worker_evaluator.error_sink.records
+    worker_evaluator.error_sink.records = []
+    return accumulator, records
+
+class AsyncEvaluator:
+    """Asyncio interface of an `Evaluator`, which evaluates the data in chunks in an executor,
+    so that the event loop is not blocked.
+
+    At most `max_pending_chunks` chunks are submitted to the executor at a time (over all calls),
+    the calls wait for a free slot before submitting more. Each call also submits only `prefetch_chunks`
+    chunks ahead of the results consumed from `aiter_results`.
+    """
 
-        logging.info(f"Total number of slots: {num_total_num_of_slot_values}")
-        logging.info(f"Slots that we cannot check: {self.num_cannot_check_slot_values}, out of which {num_type_slots} are 'type=restaurant' slots")
-        slot_errors = self.num_missing_slot_value_error+self.num_additional_slot_value_error
-        if num_total_num_of_slot_values:
-            SER = slot_errors / num_total_num_of_slot_values
+    def __init__(self, evaluator, executor=None, chunk_size=256, max_pending_chunks=8, prefetch_chunks=2):
+        """
+        Args:
+            evaluator (Evaluator): the evaluator, which also receives the found errors (in the event loop)
+            executor (concurrent.futures.Executor): executor for the evaluation, the default executor of
+                the event loop (threads) if None; a pool of processes must be created by `Evaluator.process_executor`
+            chunk_size (int): number of instances evaluated at once
+            max_pending_chunks (int): maximum number of chunks submitted to the executor
+            prefetch_chunks (int): maximum number of chunks submitted ahead of the consumed results in each call
+        """
+        self.evaluator = evaluator
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.max_pending_chunks = max_pending_chunks
+        self.prefetch_chunks = max(1, prefetch_chunks)
+        # (event loop, semaphore), see `pending_chunks`
+        self._pending_chunks = None
+
+    @property
+    def pending_chunks(self):
+        """The semaphore limiting the submitted chunks, one for each running event loop
+        (so that the evaluator can be used by several `asyncio.run` calls)"""
+        loop = asyncio.get_running_loop()
+        if self._pending_chunks is None or self._pending_chunks[0] is not loop:
+            self._pending_chunks = (loop, asyncio.Semaphore(self.max_pending_chunks))
+        return self._pending_chunks[1]
+
+    def shards(self, das, sys):
+        missing = object()
+        pairs = zip_longest(das, sys, fillvalue=missing)
+        start_index = 0
+        while True:
+            shard = list(islice(pairs, self.chunk_size))
+            if not shard:
+                return
+            assert all(da_line is not missing and sys_line is not missing for da_line, sys_line in shard), \
+                "Number of references and system outputs must match"
+            yield start_index, shard, True
+            start_index += len(shard)
+
+    async def submit(self, shard):
+        """Waits for a free slot and submits the shard to the executor"""
+        pending_chunks = self.pending_chunks
+        await pending_chunks.acquire()
+        loop = asyncio.get_running_loop()
+        if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+            future = loop.run_in_executor(self.executor, _count_errors_in_worker, shard)
         else:
-            logging.warning(f"Didn't find any valid slots")
-            SER = 0
+            future = loop.run_in_executor(self.executor, _count_errors_in_copy, self.evaluator, shard)
+        future.add_done_callback(lambda _: pending_chunks.release())
+        return future
 
-        return SER, slot_errors, self.num_missing_slot_value_error, self.num_additional_slot_value_error
+    async def aiter_results(self, das, sys):
+        """Evaluates the system outputs, yielding the `InstanceResult` of each of them in the input order.
+
+        Args:
+            das (Iterable[str]): Dialogue Act lines
+            sys (Iterable[str]): System output lines
+        """
+        pending = deque()
+        try:
+            for shard in self.shards(das, sys):
+                pending.append(await self.submit(shard))
+                if len(pending) >= self.prefetch_chunks:
+                    for instance_result in await self.collect(pending.popleft()):
+                        yield instance_result
+            while pending:
+                for instance_result in await self.collect(pending.popleft()):
+                    yield instance_result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def collect(self, future):
+        accumulator, records = await future
+        for record in records:
+            self.evaluator.error_sink.report(record)
+        return accumulator.instance_results
+
+    async def aevaluate(self, das, sys):
+        """Computes the Slot Error Rate, see `Evaluator.evaluate`.
+
+        Args:
+            das (Iterable[str]): Dialogue Act lines
+            sys (Iterable[str]): System output lines
+        """
+        accumulator = SlotErrorAccumulator()
+        async for instance_result in self.aiter_results(das, sys):
+            accumulator.add(instance_result)
+        return self.evaluator.summarize(accumulator)
+
+def log_parse_da_cache_stats():
+    stats = parse_da_cache_stats()
+    logging.info(f"DA parse cache: {stats['hits']} hits, {stats['misses']} misses, hit rate {stats['hit_rate']:.3f}, "
+                 f"size {stats['currsize']} (max. {stats['maxsize']})")
+
+# Unix socket of the evaluation server (see ser_server.py), in the runtime directory of the user
+# or in a directory of the user which only they can access (created by the server)
+SERVER_SOCKET = os.environ.get("SER_SERVER_SOCKET", os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or os.path.join(tempfile.gettempdir(), f"ser-server-{getattr(os, 'getuid', lambda: 0)()}"),
+    "ser-server.sock"))
+
+def is_own_socket(socket_path):
+    """Checks that the path is a Unix socket created by the current user,
+    so that the data are not sent to a server of another user"""
+    try:
+        st = os.stat(socket_path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+def evaluate_on_server(socket_path, surface_forms_file, das, systems, error_sink, deduplicate=True):
+    """Evaluates the system outputs on the evaluation server, which keeps the evaluators
+    ready between calls. The errors found by the server are reported to the error sink.
+
+    Args:
+        socket_path (str): Unix socket of the server
+        surface_forms_file (str): JSON file with the surface forms
+        das (List[str]): Dialogue Act lines
+        systems (dict): system name -> System output lines
+        error_sink (ErrorSink): receives the found errors
+        deduplicate (bool): evaluate identical (DA, system output) pairs only once (see `Evaluator.count_errors`)
+
+    Returns:
+        dict: system name -> result as returned by `Evaluator.evaluate`, or None if the server is not running
+    """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    if not is_own_socket(socket_path):
+        logging.warning(f"{socket_path} is not a socket of the current user, evaluating locally")
+        return None
+    request = {
+        "surface_forms_file": os.path.abspath(surface_forms_file),
+        "das": das,
+        "systems": systems,
+        "kinds": [kind for kind in ErrorRecord.KINDS if error_sink.accepts(kind)],
+        "deduplicate": deduplicate,
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            with client.makefile("rwb") as connection:
+                connection.write(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+                connection.flush()
+                response = json.loads(connection.readline().decode("utf-8"))
+    except (OSError, ValueError) as error:
+        logging.warning(f"Evaluation server at {socket_path} is not available ({error}), evaluating locally")
+        return None
+    if "error" in response:
+        raise RuntimeError(f"Evaluation server failed: {response['error']}")
+
+    results = {}
+    for name in systems:
+        for record in response["systems"][name]["records"]:
+            error_sink.report(ErrorRecord(*record))
+        accumulator = SlotErrorAccumulator.from_counts(SlotErrorCounts(*response["systems"][name]["counts"]))
+        results[name] = summarize_counts(accumulator)
+    return results
+
+def print_results(ser_score, slot_errors, num_missing_slot_value_error, num_additional_slot_value_error):
+    """Prints the results of one system, as returned by `Evaluator.evaluate`"""
+    print("Missing Slot Errors: ", num_missing_slot_value_error)
+    print("Additional Slot Errors: ", num_additional_slot_value_error)
+    print("Total Slot Errors: ", slot_errors)
+    print("SER:", ser_score)
+
+def print_results_table(results):
+    """Prints a table with the results of several systems, as returned by `Evaluator.evaluate_many`"""
+    name_width = max([len("System")] + [len(name) for name in results])
+    print(f"{'System':<{name_width}}  {'SER':>8}  {'Missing':>8}  {'Additional':>10}  {'Total':>8}")
+    for name, (ser_score, slot_errors, num_missing_slot_value_error, num_additional_slot_value_error) in results.items():
+        print(f"{name:<{name_width}}  {ser_score:>8.4f}  {num_missing_slot_value_error:>8}  {num_additional_slot_value_error:>10}  {slot_errors:>8}")
 
 def main():
     ap = ArgumentParser(description='Slot Error Rate evaluation for Czech restaurant information dataset')
     ap.add_argument('surface_forms_file', type=str, help='JSON file containing the surface forms for all slot values.')
     ap.add_argument('ref_file', type=str, help='References CSV file containing the dialogue acts (DAs) in the first column.')
-    ap.add_argument('--sys_file', type=str, help='System output file to evaluate (text file with one output per line). '+
+    ap.add_argument('--sys_file', type=str, action='append', help='System output file to evaluate (text file with one output per line). '+
+                    'May be repeated and may be a (quoted) glob pattern, all the files are then evaluated against the same references. '+
                     'If not supplied we use the reference realizations from the ref_file as the system output. '+
                     '(useful for testing and finding mistakes in the dataset)')
-    ap.add_argument('-v', '--verbosity', action="count", help="increase output verbosity (e.g., -vv is more than -v)")
+    ap.add_argument('--nbest', type=str, metavar='NBEST_FILE', help='evaluate n-best lists of system outputs instead of a --sys_file: '+
+                    'a file in the Moses n-best format ("ID ||| hypothesis ||| ..."), or a text file with --nbest_size lines for each DA; '+
+                    'prints the results of the first hypotheses and of the hypotheses with the fewest slot errors')
+    ap.add_argument('--nbest_size', type=int, help='number of hypotheses for each DA in a plain text --nbest file')
+    ap.add_argument('--rerank_output', type=str, help='write the hypothesis with the fewest slot errors for each DA to this file')
+    ap.add_argument('--stream', action='store_true', help='read the references and the system output lazily, line by line '+
+                    '(e.g. from a pipe); either of the files may be "-" for the standard input')
+    ap.add_argument('--ref_format', type=str, choices=['csv', 'json'], help='format of the references file (default: given by the file extension)')
+    ap.add_argument('--report_every', type=int, default=0, help='in the --stream mode, print the running SER to the standard error after each N lines')
+    ap.add_argument('--parse_da_cache_size', type=int, default=PARSE_DA_CACHE_SIZE, help='maximum number of parsed DAs kept in the cache')
+    ap.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes to use for the evaluation')
+    ap.add_argument('--no_dedup', action='store_true', help='evaluate also the repeated identical (DA, system output) pairs, '+
+                    'instead of reusing the result of the first one')
+    ap.add_argument('-v', '--verbosity', action="count", help="increase output verbosity (e.g., -vv is more than -v); "+
+                    "-vv logs the slot errors, -vvv also the slot values that cannot be checked")
+    ap.add_argument('--error_log', type=str, help='write all slot errors and unchecked slot values to this JSONL file')
+    ap.add_argument('--bootstrap', type=int, default=0, metavar='N', help='print a 95%% bootstrap confidence interval of the SER '+
+                    'computed from N resamples (requires NumPy)')
+    ap.add_argument('--compare', type=str, metavar='OTHER_SYS_FILE', help='test the difference in SER against another system output '+
+                    'file using the paired approximate randomization test (requires NumPy)')
+    ap.add_argument('--randomization_samples', type=int, default=10000, help='number of random swaps in the --compare test')
+    ap.add_argument('--seed', type=int, help='random seed for --bootstrap and --compare')
+    ap.add_argument('--breakdown', type=str, choices=['table', 'json'], help='print the numbers of slot values and errors by DA type '+
+                    'and by slot, and the confusions of the expected and found slot values, as tables or JSON')
+    ap.add_argument('--server_socket', type=str, default=SERVER_SOCKET, help='evaluate on the evaluation server (ser_server.py) listening on this Unix socket '+
+                    'if it is running (default: %(default)s, or the SER_SERVER_SOCKET environment variable)')
+    ap.add_argument('--no_server', action='store_true', help='always evaluate in this process, even if the evaluation server is running')
+    ap.add_argument('--profile', action='store_true', help='print the time spent in the slot handlers and the evaluation phases, '+
+                    'and the slowest instances, to the standard error (the evaluation then runs in a single process)')
     args = ap.parse_args()
 
     if args.verbosity == 3:
@@ -434,15 +1999,130 @@ def main():
     if args.verbosity == 0:
         logging.getLogger().setLevel(logging.ERROR)
 
-    surface_forms, das, sys = load_data(args.surface_forms_file, args.ref_file, args.sys_file)
+    if args.parse_da_cache_size != PARSE_DA_CACHE_SIZE:
+        set_parse_da_cache_size(args.parse_da_cache_size)
 
-    ser = Evaluator(surface_forms)
-    ser_score, slot_errors, num_missing_slot_value_error, num_additional_slot_value_error = ser.evaluate(das, sys)
+    # Slot errors are logged according to the verbosity, and optionally written to a file
+    error_sink = LoggingErrorSink()
+    if args.error_log:
+        jsonl_sink = JsonlErrorSink(args.error_log)
+        error_sink = CombinedErrorSink([error_sink, jsonl_sink])
 
-    print("Missing Slot Errors: ", num_missing_slot_value_error)
-    print("Additional Slot Errors: ", num_additional_slot_value_error)
-    print("Total Slot Errors: ", slot_errors)
-    print("SER:", ser_score)
+    if args.profile and args.jobs > 1:
+        logging.warning("Profiling runs the evaluation in a single process, ignoring --jobs")
+        args.jobs = 1
+    if (args.nbest or args.stream) and args.jobs > 1:
+        logging.warning("The n-best lists and streams are evaluated in a single process, ignoring --jobs")
+        args.jobs = 1
+
+    sys_files = expand_sys_files(args.sys_file) if args.sys_file else []
+    assert not (args.bootstrap or args.compare or args.breakdown) or (not args.stream and len(sys_files) <= 1), \
+        "--bootstrap, --compare and --breakdown can only be used for a single system output file without --stream"
+    if args.bootstrap or args.compare:
+        require_numpy()
+    assert not args.nbest or not (sys_files or args.stream or args.bootstrap or args.compare or args.breakdown), \
+        "--nbest cannot be combined with --sys_file, --stream, --bootstrap, --compare or --breakdown"
+    assert not args.rerank_output or args.nbest, "--rerank_output requires --nbest"
+    # The server is used for the plain evaluation of one or more system output files;
+    # it evaluates in a single process, so parallel evaluation (--jobs) runs locally
+    server_results = None
+    if not args.no_server and os.path.exists(args.server_socket) and args.jobs == 1 and not (args.stream or args.nbest or args.bootstrap or args.compare or args.breakdown or args.profile):
+        das, systems = load_systems(args.ref_file, sys_files)
+        server_results = evaluate_on_server(args.server_socket, args.surface_forms_file, das, systems, error_sink, deduplicate=not args.no_dedup)
+
+    if server_results is not None:
+        results = server_results if len(sys_files) > 1 else next(iter(server_results.values()))
+    elif args.nbest:
+        surface_forms, das, _ = load_data(args.surface_forms_file, args.ref_file, None)
+        nbest_lists = read_nbest(args.nbest, args.nbest_size)
+        ser = Evaluator(surface_forms, error_sink, deduplicate=not args.no_dedup)
+        if args.profile:
+            ser.enable_profiling()
+        nbest_results = ser.evaluate_nbest(das, nbest_lists)
+        best = rerank_nbest(nbest_results)
+        results = {}
+        for name, ranks in [("first", [0] * len(das)), ("reranked", best)]:
+            accumulator = SlotErrorAccumulator()
+            for rank, hypothesis_results in zip(ranks, nbest_results):
+                accumulator.add(hypothesis_results[rank])
+            logging.info(f"Results of the {name} hypotheses")
+            results[name] = ser.summarize(accumulator)
+        if args.rerank_output:
+            with open(args.rerank_output, "w") as fh:
+                for rank, hypotheses in zip(best, nbest_lists):
+                    print(hypotheses[rank], file=fh)
+    elif args.stream:
+        assert len(sys_files) <= 1, "Only one system output file can be evaluated in the --stream mode"
+        surface_forms = read_surface_forms(args.surface_forms_file)
+        if sys_files:
+            das = (row["da"] for row in iter_ref(args.ref_file, args.ref_format))
+            sys = iter_lines(sys_files[0])
+        else:
+            # both are read in lockstep, so tee only keeps one row in memory
+            das_refs, sys_refs = tee(iter_ref(args.ref_file, args.ref_format))
+            das = (row["da"] for row in das_refs)
+            sys = (row["text"] for row in sys_refs)
+
+        def report(counts):
+            print(f"Lines: {counts.num_das}, Missing: {counts.num_missing_slot_value_error}, "
+                  f"Additional: {counts.num_additional_slot_value_error}, SER: {counts.ser}", file=stderr, flush=True)
+
+        ser = Evaluator(surface_forms, error_sink, deduplicate=not args.no_dedup)
+        if args.profile:
+            ser.enable_profiling()
+        results = ser.evaluate_stream(das, sys, args.report_every, report)
+    elif len(sys_files) > 1:
+        surface_forms, das, systems = load_many_data(args.surface_forms_file, args.ref_file, sys_files)
+        ser = Evaluator(surface_forms, error_sink, deduplicate=not args.no_dedup)
+        if args.profile:
+            ser.enable_profiling()
+        results = ser.evaluate_many(das, systems, args.jobs)
+    elif args.bootstrap or args.compare or args.breakdown:
+        surface_forms, das, sys = load_data(args.surface_forms_file, args.ref_file, sys_files[0] if sys_files else None)
+        ser = Evaluator(surface_forms, error_sink, deduplicate=not args.no_dedup)
+        if args.profile:
+            ser.enable_profiling()
+        prepared_das = [PreparedDA.from_line(da_line) for da_line in das]
+        breakdown = SlotErrorBreakdown() if args.breakdown else None
+        results, instance_arrays = ser.evaluate_prepared(prepared_das, sys, args.jobs, per_instance=True, breakdown=breakdown)
+        if args.compare:
+            # the errors of the other system are only used for the test, not reported
+            ser.error_sink = ErrorSink()
+            other_sys = read_lines(args.compare)
+            assert len(das) == len(other_sys), f"Number of references and system outputs in {args.compare} must match ({len(das)} != {len(other_sys)})"
+            _, other_instance_arrays = ser.evaluate_prepared(prepared_das, other_sys, args.jobs, per_instance=True)
+    else:
+        surface_forms, das, sys = load_data(args.surface_forms_file, args.ref_file, sys_files[0] if sys_files else None)
+        ser = Evaluator(surface_forms, error_sink, deduplicate=not args.no_dedup)
+        if args.profile:
+            ser.enable_profiling()
+        results = ser.evaluate(das, sys, args.jobs)
+
+    if args.error_log:
+        jsonl_sink.close()
+    if server_results is None:
+        log_parse_da_cache_stats()
+    if args.profile:
+        ser.profiler.print_summary()
+
+    if args.nbest or (len(sys_files) > 1 and not args.stream):
+        print_results_table(results)
+    else:
+        print_results(*results)
+
+    if args.bootstrap:
+        lower, upper = bootstrap_ser_ci(instance_arrays.errors, instance_arrays.slots, args.bootstrap, seed=args.seed)
+        print(f"SER 95% CI: [{lower}, {upper}]")
+    if args.compare:
+        other_ser = other_instance_arrays.result()[0]
+        p_value = paired_randomization_test(instance_arrays.errors, other_instance_arrays.errors, args.randomization_samples, seed=args.seed)
+        print(f"SER of {args.compare}: {other_ser}")
+        print(f"Paired randomization test p-value: {p_value}")
+    if args.breakdown == 'table':
+        print()
+        breakdown.print_tables()
+    elif args.breakdown == 'json':
+        print(json.dumps(breakdown.to_dict(), ensure_ascii=False, indent=2))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
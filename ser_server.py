@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""Evaluation server, which keeps the evaluators ready between the runs of measure_slot_error_rate.py.
+
+The server listens on a Unix socket; measure_slot_error_rate.py evaluates on it whenever it is
+running (unless --no_server is given), so the evaluation does not pay for loading the surface
+forms and preparing the evaluator every time. The socket is accessible only by the user who
+started the server, and measure_slot_error_rate.py uses only the sockets of its own user.
+
+Each connection sends one JSON request on a line:
+    {"surface_forms_file": ..., "das": [...], "systems": {name: [...]}, "kinds": [...], "deduplicate": true}
+and receives one JSON response on a line:
+    {"systems": {name: {"counts": [...], "records": [...]}}} or {"error": ...}
+where the counts are `SlotErrorCounts` and the records are the `ErrorRecord`s of the given kinds.
+"""
+
+from argparse import ArgumentParser
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+
+from measure_slot_error_rate import SERVER_SOCKET, ErrorSink, Evaluator, ListErrorSink, PreparedDA, read_surface_forms
+
+class EvaluationService:
+    """Evaluates the requests one by one in a single thread, with one evaluator per surface forms file."""
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        # surface forms file -> (modification time and size, Evaluator)
+        self.evaluators = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        """Evaluates the request (from any thread) and returns the response"""
+        response = queue.Queue(maxsize=1)
+        self.requests.put((request, response))
+        return response.get()
+
+    def get_evaluator(self, surface_forms_file):
+        """Returns the evaluator for the surface forms file, reloaded if the file changed"""
+        stat = os.stat(surface_forms_file)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if surface_forms_file not in self.evaluators or self.evaluators[surface_forms_file][0] != version:
+            logging.info(f"Loading surface forms from {surface_forms_file}")
+            self.evaluators[surface_forms_file] = (version, Evaluator(read_surface_forms(surface_forms_file), ErrorSink()))
+        return self.evaluators[surface_forms_file][1]
+
+    def run(self):
+        while True:
+            request, response = self.requests.get()
+            try:
+                response.put(self.evaluate(self.get_evaluator(request["surface_forms_file"]), request))
+            except Exception as error:
+                logging.exception("Evaluation failed")
+                response.put({"error": f"{type(error).__name__}: {error}"})
+
+    def evaluate(self, evaluator, request):
+        sink = ListErrorSink(request.get("kinds", []))
+        evaluator.error_sink = sink
+        evaluator.deduplicate = request.get("deduplicate", True)
+        prepared_das = [PreparedDA.from_line(da_line) for da_line in request["das"]]
+        systems = {}
+        for name, sys in request["systems"].items():
+            assert len(prepared_das) == len(sys), f"Number of references and system outputs in {name} must match ({len(prepared_das)} != {len(sys)})"
+            sink.records = []
+            accumulator = evaluator.count_errors(prepared_das, sys)
+            systems[name] = {"counts": list(accumulator.counts), "records": [list(record) for record in sink.records]}
+        return {"systems": systems}
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError as error:
+            response = {"error": f"Invalid request: {error}"}
+        else:
+            response = self.server.service.submit(request)
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+
+class EvaluationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        super().__init__(socket_path, RequestHandler)
+
+def remove_stale_socket(socket_path):
+    """Removes the socket file if no server is listening on it"""
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return
+    raise RuntimeError(f"An evaluation server is already running at {socket_path}")
+
+def make_socket_dir(socket_path):
+    """Creates the directory of the socket if it does not exist, accessible only by the current user"""
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, mode=0o700)
+
+def stop(signum, frame):
+    raise SystemExit(0)
+
+def main():
+    ap = ArgumentParser(description='Evaluation server for measure_slot_error_rate.py, which keeps the evaluators ready between the runs')
+    ap.add_argument('--socket', type=str, default=SERVER_SOCKET, help='Unix socket to listen on (default: %(default)s)')
+    ap.add_argument('-v', '--verbose', action='store_true', help='log the loading of the surface forms and the errors')
+    args = ap.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    make_socket_dir(args.socket)
+    remove_stale_socket(args.socket)
+    # only the current user may connect to the socket
+    umask = os.umask(0o077)
+    try:
+        server = EvaluationServer(args.socket, EvaluationService())
+    finally:
+        os.umask(umask)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+if __name__ == '__main__':
+    main()
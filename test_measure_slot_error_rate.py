@@ -1,4 +1,27 @@
-from measure_slot_error_rate import parse_da, Evaluator, logging
+import asyncio
+import json
+import os
+import tempfile
+import threading
+
+import lexicon as lexicon_module
+import measure_slot_error_rate
+import ser_server
+from measure_slot_error_rate import (
+    AsyncEvaluator, ConsumableSentence, ErrorRecord, ErrorSink, EvaluationProfiler, Evaluator, InstanceArrays,
+    JsonlErrorSink, KidsNegationScanner, ListErrorSink, PreparedDA, PreparedSentence, SlotErrorAccumulator,
+    SlotErrorBreakdown, SurfaceFormAutomaton, bootstrap_ser_ci, iter_json, logging, paired_randomization_test,
+    parse_da, parse_da_cache_stats, parse_da_cached, read_nbest, rerank_nbest, set_parse_da_cache_size,
+    surface_form_variants)
+
+def restaurant_surface_forms():
+    """Surface forms of two restaurant names, shared by the tests (a new copy for each test)"""
+    return {
+        "name": {
+            "Restaurace A": ["Restaurace A\tRestaurace A\tNNFS1-----A----"],
+            "Restaurace B": ["Restaurace B\tRestaurace B\tNNFS1-----A----"],
+        }
+    }
 
 def test_parse_da():
     da = "inform(abc=123)"
@@ -21,6 +44,24 @@ def test_parse_da():
         "attributes": {"rr": ["Baráčnická Rychta", "dont_care"], "cc": ["382"]}
     }
 
+def test_parse_da_cached():
+    set_parse_da_cache_size(2)
+    da = "?request(rr='Baráčnická Rychta',rr=dont_care,cc=382)"
+    parsed = parse_da_cached(da)
+
+    assert parsed.type == "?request"
+    assert parsed.attributes == (("rr", ("Baráčnická Rychta", "dont_care")), ("cc", ("382",)))
+    assert parsed.to_dict() == parse_da(da)
+    # The same object is returned for the same DA, and it is hashable
+    assert parse_da_cached(da) is parsed
+    assert {parsed: 1}[parse_da_cached(da)] == 1
+
+    parse_da_cached("inform()")
+    parse_da_cached("hello()")
+    stats = parse_da_cache_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 3 and stats["currsize"] == 2 and stats["hit_rate"] == 2 / 5
+    set_parse_da_cache_size(measure_slot_error_rate.PARSE_DA_CACHE_SIZE)
+
 def test_evaluator_name():
     surface_forms = {
         "name": {
@@ -88,9 +129,469 @@ def test_evaluator_kids_allowed():
     error_rate, errs, miss, add = ser.evaluate(["inform(count=12)"], ["V nabídce je 12 restaurací, které nemají požadavky ohledně dětí"])
     assert error_rate == 1 and miss == 0 and add == 1
 
+def test_surface_form_automaton():
+    automaton = SurfaceFormAutomaton([("Restaurace A", 0), ("Restauraci A", 0), ("Restaurace", 1), ("ace", 2), ("Jídlo", 3)])
+
+    # Overlapping hits are reported for each payload, the longest one for each
+    assert automaton.find_all("Našla jsem Restaurace A") == {0: "Restaurace A", 1: "Restaurace", 2: "ace"}
+    assert automaton.find_all("Restaurace, restaurace A") == {1: "Restaurace", 2: "ace"}
+    # Matches at the start of the alternative spelling are reported in the original form
+    assert automaton.find_all("Jídlo dobré", "jídlo dobré") == {3: "Jídlo"}
+    assert automaton.find_all("Restauraci A", "restauraci A") == {0: "Restauraci A"}
+    assert automaton.find_all("Ace je tu", "ace je tu") == {2: "Ace"}
+    assert automaton.find_all("") == {}
+
+def test_surface_form_variants():
+    assert surface_form_variants(["pro děti", "dětí", "Pro Děti"]) == ("pro děti", "Pro Děti", "dětí", "Dětí")
+    assert PreparedSentence.from_text("Děti ano") == ("Děti ano", "děti ano")
+    assert PreparedSentence.from_text("") == ("", "")
+
+    ser = Evaluator({})
+    assert ser.surface_forms_match("Děti jsou vítány", ser.kids_surface_form_variants) == "Děti"
+    assert ser.surface_forms_match(PreparedSentence.from_text("Pro dětí"), ser.kids_surface_form_variants) == "dětí"
+    assert ser.surface_forms_match("Bez omezení", ser.kids_surface_form_variants) is False
+
+def test_consumable_sentence():
+    sentence = ConsumableSentence("Restaurace A má číslo 223344 , Restaurace A je tu")
+    # Matches start at token boundaries and do not end inside a number
+    assert sentence.match("ace") is False
+    assert sentence.match("22") is False
+    assert sentence.match("Restaurac") == "Restaurac"
+    assert sentence.match("restaurace A") == "Restaurace A"
+    # All the occurrences are consumed and they are not matched again
+    assert sentence.consume("Restaurace A") == 2
+    assert sentence.match("Restaurace") is False
+    assert sentence.match("A má") is False
+    assert sentence.remaining() == " má číslo 223344 , je tu"
+    assert sentence.remaining() is sentence.remaining()
+    # The remaining text is rebuilt after the next consumed span
+    assert sentence.consume("223344") == 1
+    assert sentence.remaining() == " má číslo , je tu"
+
+    ser = Evaluator({
+        "name": {"Restaurace A": ["Restaurace A\tRestaurace A"]},
+        "food": {"Ace": ["Ace\tace"]},
+    }, ErrorSink())
+    # A slot value is not found inside a longer word, neither as missing nor additional
+    assert ser.evaluate(["inform(name='Restaurace A')"], ["Restaurace A je tu"])[0] == 0
+    assert ser.evaluate(["inform(food=Ace)"], ["Restaurace je tu"])[2:] == (1, 0)
+    assert ser.evaluate(["inform(count=3)"], ["Volejte 223344"])[2:] == (1, 0)
+    assert ser.evaluate(["inform(count=3)"], ["Jsou tu 3 restaurace"])[0] == 0
+
+def test_kids_negation_scanner():
+    scanner = KidsNegationScanner(3)
+
+    assert scanner.find("Restaurace není vhodná pro děti") == "není"
+    assert scanner.find("Restaurace NENÍ vhodná pro děti") == "NENÍ"
+    assert scanner.find("Děti sem nesmí") == "nesmí"
+    # The conjunction "a" after "děti" is not followed to a negation
+    assert scanner.find("Pro děti a nekuřáky") is False
+    assert scanner.find("Vstup dětem zakázán") == "zakázán"
+    assert scanner.find("Je to restaurace bez dětí") == "bez"
+    # The negation is too far
+    assert scanner.find("Není to restaurace , která by byla vhodná pro děti") is False
+    assert KidsNegationScanner(5).find("Nejde o podnik , který by byl vhodný pro děti") is False
+    assert KidsNegationScanner(5).find("Nejde o podnik vhodný pro děti") == "Nejde"
+    assert scanner.find("Restaurace je vhodná pro děti") is False
+
+def test_evaluator_evaluate_many():
+    surface_forms = restaurant_surface_forms()
+    ser = Evaluator(surface_forms)
+    das = ["inform(name='Restaurace A')", "inform(kids_allowed=no)"]
+    systems = {
+        "good": ["Restaurace A je tady", "Restaurace není vhodná pro děti"],
+        "bad": ["Restaurace B je tady", "Restaurace je vhodná pro děti"],
+    }
+    results = ser.evaluate_many(das, systems)
+
+    assert list(results) == ["good", "bad"]
+    assert results["good"] == (0, 0, 0, 0)
+    assert results["bad"] == (2, 4, 2, 2)
+    for name, sys in systems.items():
+        assert ser.evaluate(das, sys) == results[name]
+
+def test_evaluator_jobs():
+    surface_forms = restaurant_surface_forms()
+    ser = Evaluator(surface_forms)
+    das = ["inform(name='Restaurace A')", "inform(kids_allowed=no)", "inform(type=restaurant,name=none)", "?request(name)"] * 5
+    sys = ["Restaurace B je tady", "Restaurace není vhodná pro děti", "Restaurace A", "Jakou restauraci?"] * 5
+
+    serial = ser.evaluate(das, sys)
+    assert ser.evaluate(das, sys, jobs=3) == serial
+    assert ser.num_cannot_check_slot_values == 15
+    assert ser.evaluate_many(das, {"a": sys, "b": sys}, jobs=2) == {"a": serial, "b": serial}
+
+def test_iter_json():
+    data = [{"da": "inform(name='Restaurace A')", "text": "Restaurace A , [1]"}, {"da": "hello()", "text": "Dobrý den"}, 12345, 12.5, -1e-3, []]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_file = os.path.join(tmp_dir, "data.json")
+        with open(json_file, "w") as fh:
+            json.dump(data, fh, indent=4, ensure_ascii=False)
+        # small chunks split the items
+        for chunk_size in [1, 2, 3, 7, 65536]:
+            assert list(iter_json(json_file, chunk_size)) == data
+        # numbers split at the end of a chunk
+        with open(json_file, "w") as fh:
+            fh.write("[12.5,1e5]")
+        for chunk_size in [1, 2, 3, 4]:
+            assert list(iter_json(json_file, chunk_size)) == [12.5, 1e5]
+
+        with open(json_file, "w") as fh:
+            fh.write(" [ ] ")
+        assert list(iter_json(json_file, 2)) == []
+
+def test_evaluator_evaluate_stream():
+    surface_forms = restaurant_surface_forms()
+    ser = Evaluator(surface_forms)
+    das = ["inform(name='Restaurace A')", "inform(kids_allowed=no)", "inform(type=restaurant,name=none)"] * 3
+    sys = ["Restaurace B je tady", "Restaurace není vhodná pro děti", "Restaurace A"] * 3
+
+    reports = []
+    result = ser.evaluate_stream(iter(das), iter(sys), report_every=4, report=reports.append)
+    assert result == ser.evaluate(das, sys)
+    assert [counts.num_das for counts in reports] == [4, 8]
+    assert reports[0].slot_errors == 5 and reports[0].ser == 1
+
+    try:
+        ser.evaluate_stream(iter(das), iter(sys[:-1]))
+        assert False, "different lengths must fail"
+    except AssertionError as e:
+        assert "must match" in str(e)
+
+def test_evaluator_evaluate_one():
+    surface_forms = restaurant_surface_forms()
+    ser = Evaluator(surface_forms)
+
+    result = ser.evaluate_one("inform(name='Restaurace A',type=restaurant)", "Restaurace B je tady")
+    assert result.num_slot_values == 2
+    assert result.num_missing_slot_value_error == 1 and result.num_additional_slot_value_error == 1
+    assert result.num_cannot_check_slot_values == 1 and result.num_type_slots == 1
+    assert result.slot_errors == 2
+
+    # Accumulators of parts of the data merge into the result of the whole data
+    das = ["inform(name='Restaurace A',type=restaurant)", "inform(kids_allowed=no)", "?request(name)"]
+    sys = ["Restaurace B je tady", "Restaurace není vhodná pro děti", "Restaurace A nebo B?"]
+    first, second = SlotErrorAccumulator(), SlotErrorAccumulator()
+    first.add(ser.evaluate_one(das[0], sys[0]))
+    for da, sys_line in zip(das[1:], sys[1:]):
+        second.add(ser.evaluate_one(da, sys_line))
+    assert first.merge(second).result() == ser.evaluate(das, sys)
+    assert first.counts.num_das == 3 and first.counts.num_slot_values == 4
+
+def test_error_sinks():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A')", "inform(kids_allowed=dont_care,name=none)"]
+    sys = ["Restaurace B je tady", "Restaurace A je pro děti"]
+
+    sink = ListErrorSink()
+    ser = Evaluator(surface_forms, sink)
+    result = ser.evaluate(das, sys)
+    assert sink.records == [
+        ErrorRecord(0, "missing", "name", "Restaurace A", None, sys[0], das[0]),
+        ErrorRecord(0, "additional", "name", "Restaurace B", "Restaurace B", sys[0], das[0]),
+        ErrorRecord(1, "unchecked", "kids_allowed", "dont_care", None, sys[1], das[1]),
+        ErrorRecord(1, "unchecked", "name", "none", None, sys[1], das[1]),
+        ErrorRecord(1, "additional", "name", "Restaurace A", "Restaurace A", sys[1], das[1]),
+    ]
+
+    # The records come back from the worker processes in the same order
+    parallel_sink = ListErrorSink(["missing", "additional"])
+    assert Evaluator(surface_forms, parallel_sink).evaluate(das * 3, sys * 3, jobs=2) == ser.evaluate(das * 3, sys * 3)
+    assert [record.index for record in parallel_sink.records] == [0, 0, 1, 2, 2, 3, 4, 4, 5]
+
+    # A disabled sink does not change the result
+    assert Evaluator(surface_forms, ErrorSink()).evaluate(das, sys) == result
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        jsonl_file = os.path.join(tmp_dir, "errors.jsonl")
+        jsonl_sink = JsonlErrorSink(jsonl_file, kinds=["missing"])
+        Evaluator(surface_forms, jsonl_sink).evaluate(das, sys)
+        jsonl_sink.close()
+        with open(jsonl_file) as fh:
+            assert [json.loads(line) for line in fh] == [sink.records[0]._asdict()]
+
+def test_significance():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A')", "inform(name='Restaurace B',type=restaurant)"] * 20
+    good = ["Restaurace A je tady", "Restaurace B je tady"] * 20
+    bad = ["Restaurace B je tady", "Restaurace B je tady"] * 20
+    ser = Evaluator(surface_forms, ErrorSink())
+
+    result, arrays = ser.evaluate(das, bad, per_instance=True)
+    assert result == ser.evaluate(das, bad)
+    assert list(arrays.errors[:2]) == [2, 0] and list(arrays.slots[:2]) == [1, 2]
+    assert list(arrays.unchecked[:2]) == [0, 1]
+    # The per-instance arrays are kept in the input order also with worker processes
+    _, parallel_arrays = ser.evaluate(das, bad, jobs=2, per_instance=True)
+    assert all((a == b).all() for a, b in zip(arrays, parallel_arrays))
+
+    lower, upper = bootstrap_ser_ci(arrays.errors, arrays.slots, 500, seed=0)
+    assert lower <= result[0] <= upper and lower < upper
+    assert bootstrap_ser_ci(arrays.errors, arrays.slots, 500, seed=0, max_chunk_size=100) == \
+        bootstrap_ser_ci(arrays.errors, arrays.slots, 500, seed=0)
+
+    _, good_arrays = ser.evaluate(das, good, per_instance=True)
+    assert bootstrap_ser_ci(good_arrays.errors, good_arrays.slots, 100, seed=0) == (0.0, 0.0)
+    assert paired_randomization_test(arrays.errors, good_arrays.errors, 1000, seed=0) < 0.01
+    assert paired_randomization_test(arrays.errors, arrays.errors, 1000, seed=0) == 1.0
+    try:
+        paired_randomization_test(arrays.errors, good_arrays.errors[:-1], 1000, seed=0)
+        assert False, "Systems evaluated on different instances must fail"
+    except AssertionError as error:
+        assert "same instances" in str(error)
+
+def test_profiling():
+    surface_forms = restaurant_surface_forms()
+    del surface_forms["name"]["Restaurace B"]
+    das = ["inform(name='Restaurace A',kids_allowed=no)", "inform(phone=123)", "inform(name='Restaurace A')"]
+    sys = ["Restaurace A není pro děti", "Číslo je 123", "Restaurace B"]
+    ser = Evaluator(surface_forms, ErrorSink())
+    result = ser.evaluate(das, sys)
+
+    profiler = ser.enable_profiling(EvaluationProfiler(num_slowest=2))
+    assert ser.evaluate(das, sys) == result
+    assert profiler.calls["evaluate_one"] == 3 and profiler.calls["count_additional_errors"] == 3
+    assert profiler.calls["handle_kids_allowed"] == 1 and profiler.calls["exact_match"] == 1
+    assert profiler.times["evaluate_one"] >= profiler.times["count_additional_errors"] > 0
+    assert len(profiler.slowest) == 2 and {index for _, index, _, _ in profiler.slowest} <= {0, 1, 2}
+
+    # Disabling removes the wrappers
+    ser.disable_profiling()
+    assert ser.profiler is None and "evaluate_one" not in ser.__dict__
+    assert ser.evaluate(das, sys) == result
+    assert profiler.calls["evaluate_one"] == 3
+
+def test_lexicon():
+    surface_forms = {
+        "name": {
+            "Restaurace A": ["Restaurace A\tRestaurace A\tNNFS1-----A----"],
+        },
+        "street": {
+            "Karlova": ["Karlova\tKarlově\tAAFS6----1A----"],
+        },
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_file = os.path.join(tmp_dir, "surface_forms.json")
+        with open(json_file, "w") as fh:
+            json.dump(surface_forms, fh)
+
+        lexicon = lexicon_module.load_lexicon(json_file)
+        assert lexicon.surface_forms == surface_forms
+        assert lexicon.forms == {"name": {"Restaurace A": ["Restaurace A"]}, "street": {"Karlova": ["Karlově"]}}
+        assert lexicon.form_index[("karlově", "_")] == [("Karlova _", "AAFS6----1A----")]
+        assert lexicon.reverse_index[("restaurace a", "Restaurace A", "NNFS1-----A----")] == ("name", "Restaurace A")
+        assert lexicon.max_form_len == 2
+        # The tables are built only once
+        assert lexicon.forms is lexicon.forms and lexicon.form_index is lexicon.form_index
+
+    surface_forms["name"]["Restaurace B"] = ["Restaurace B\tRestaurace B\tNNFS1-----A----"]
+    das = ["inform(name='Restaurace A')", "inform(name='Restaurace B')"]
+    sys = ["Restaurace B je tady", "Restaurace B je tady"]
+    assert Evaluator(lexicon_module.Lexicon(surface_forms), ErrorSink()).evaluate(das, sys) == \
+        Evaluator(surface_forms, ErrorSink()).evaluate(das, sys)
+
+def test_server():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A')", "inform(name='Restaurace B',type=restaurant)"]
+    systems = {"first": ["Restaurace B je tady", "Restaurace B je tady"], "second": ["Restaurace A", "Restaurace B"]}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "server.sock")
+        json_file = os.path.join(tmp_dir, "surface_forms.json")
+        with open(json_file, "w") as fh:
+            json.dump(surface_forms, fh)
+        assert measure_slot_error_rate.evaluate_on_server(socket_path, json_file, das, systems, ErrorSink()) is None
+        # only the sockets of the current user are used
+        assert measure_slot_error_rate.evaluate_on_server(json_file, json_file, das, systems, ErrorSink()) is None
+
+        server = ser_server.EvaluationServer(socket_path, ser_server.EvaluationService())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            sink = ListErrorSink(["missing"])
+            results = measure_slot_error_rate.evaluate_on_server(socket_path, json_file, das, systems, sink)
+            local_sink = ListErrorSink(["missing"])
+            local_ser = Evaluator(surface_forms, local_sink)
+            assert results == local_ser.evaluate_many(das, systems)
+            assert sink.records == local_sink.records
+
+            # The local options are forwarded to the server
+            sink = ListErrorSink(["missing"])
+            results = measure_slot_error_rate.evaluate_on_server(socket_path, json_file, das * 2, {"second": systems["second"] * 2}, sink, deduplicate=False)
+            local_sink = ListErrorSink(["missing"])
+            assert results == {"second": Evaluator(surface_forms, local_sink, deduplicate=False).evaluate(das * 2, systems["second"] * 2)}
+            assert sink.records == local_sink.records
+
+            # The server reloads the surface forms when the file changes
+            del surface_forms["name"]["Restaurace B"]
+            with open(json_file, "w") as fh:
+                json.dump(surface_forms, fh, indent=1)
+            results = measure_slot_error_rate.evaluate_on_server(socket_path, json_file, das[:1], {"first": systems["first"][:1]}, ErrorSink())
+            assert results == {"first": Evaluator(surface_forms, ErrorSink()).evaluate(das[:1], systems["first"][:1])}
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+def test_async_evaluator():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A')", "inform(name='Restaurace B',type=restaurant)", "inform(kids_allowed=no)"] * 5
+    sys = ["Restaurace B je tady", "Restaurace B je tady", "Restaurace není pro děti"] * 5
+    local_sink = ListErrorSink()
+    result = Evaluator(surface_forms, local_sink).evaluate(das, sys)
+
+    async def evaluate_all(async_ser):
+        instance_results = [instance_result async for instance_result in async_ser.aiter_results(das, sys)]
+        # concurrent calls share the limit of the submitted chunks
+        results = await asyncio.gather(async_ser.aevaluate(das, sys), async_ser.aevaluate(iter(das), iter(sys)))
+        return instance_results, results
+
+    sink = ListErrorSink()
+    async_ser = AsyncEvaluator(Evaluator(surface_forms, sink), chunk_size=4, max_pending_chunks=1)
+    instance_results, results = asyncio.run(evaluate_all(async_ser))
+    assert [instance_result.slot_errors for instance_result in instance_results[:3]] == [2, 0, 0]
+    assert len(instance_results) == len(das) and results == [result, result]
+    assert sink.records[:len(local_sink.records)] == local_sink.records
+    # the evaluator can be reused in another event loop (e.g. one `asyncio.run` per epoch)
+    instance_results, results = asyncio.run(evaluate_all(async_ser))
+    assert len(instance_results) == len(das) and results == [result, result]
+
+    ser = Evaluator(surface_forms, ErrorSink())
+    with ser.process_executor(2) as executor:
+        assert asyncio.run(AsyncEvaluator(ser, executor, chunk_size=4).aevaluate(das, sys)) == result
+
+    try:
+        asyncio.run(AsyncEvaluator(ser).aevaluate(das, sys[:-1]))
+        assert False, "Different numbers of references and system outputs must fail"
+    except AssertionError as error:
+        assert "must match" in str(error)
+
+def test_instance_arrays():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A')", "inform(name='Restaurace B',type=restaurant)", "goodbye()", "inform(name='Restaurace A')"]
+    sys = ["Restaurace B je tady", "Restaurace B je tady", "Na shledanou", "Restaurace A"]
+    ser = Evaluator(surface_forms, ErrorSink())
+    result, arrays = ser.evaluate(das, sys, per_instance=True)
+    assert arrays.result() == result
+
+    # Subsets are masked sums of the same arrays
+    is_inform = [da.startswith("inform") for da in das]
+    assert arrays.result(is_inform) == ser.evaluate(das[:2] + das[3:], sys[:2] + sys[3:])
+    assert arrays.result([False, True, True, False]) == ser.evaluate(das[1:3], sys[1:3])
+
+    # array.array works the same as NumPy
+    plain_arrays = InstanceArrays.from_results(ser.count_errors(das, sys, keep_instance_results=True).instance_results, use_numpy=False)
+    assert [list(values) for values in plain_arrays] == [list(values) for values in arrays]
+    assert list(plain_arrays.errors) == list(arrays.errors) == [2, 0, 0, 0]
+    assert plain_arrays.result(is_inform) == arrays.result(is_inform)
+
+    many = ser.evaluate_many(das, {"first": sys, "second": sys[::-1]}, per_instance=True)
+    assert many["first"][0] == result and list(many["first"][1].slots) == list(arrays.slots)
+    assert many["second"][0] == many["second"][1].result()
+
+def test_breakdown():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A',type=restaurant)", "inform(name='Restaurace B')", "?request(name)", "inform(kids_allowed=no)"]
+    sys = ["Restaurace B je tady", "Restaurace B je tady", "Chcete Restaurace A nebo B?", "Nevím"]
+    sink = ListErrorSink()
+    ser = Evaluator(surface_forms, sink)
+    result = ser.evaluate(das, sys)
+
+    for jobs in (1, 2):
+        breakdown = SlotErrorBreakdown()
+        assert ser.evaluate(das, sys, jobs=jobs, breakdown=breakdown) == result
+        breakdown = breakdown.to_dict()
+        assert breakdown["da_types"]["inform"] == {"das": 3, "slot_values": 4, "missing": 2, "additional": 1, "ser": 0.75}
+        assert breakdown["da_types"]["?request"]["additional"] == 0
+        assert breakdown["slots"]["name"] == {"slot_values": 3, "missing": 1, "additional": 1, "unchecked": 1, "ser": 2 / 3}
+        assert breakdown["slots"]["type"] == {"slot_values": 1, "unchecked": 1, "ser": 0}
+        assert breakdown["confusions"] == [
+            {"slot": "name", "expected": "Restaurace A", "found": "Restaurace B", "count": 1},
+            {"slot": "kids_allowed", "expected": "no", "found": None, "count": 1},
+        ]
+    # The error sink of the evaluator still gets the errors, and is restored afterwards
+    assert sink.records and sink.records == sink.records[:len(sink.records) // 3] * 3
+    assert ser.error_sink is sink
+
+def test_deduplication():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A')", "hello()", "inform(name='Restaurace A')", "hello()", "inform(name='Restaurace A')"]
+    sys = ["Restaurace B je tady", "Dobrý den", "Restaurace B je tady", "Dobrý den", "Restaurace A"]
+
+    results = []
+    for deduplicate in (True, False):
+        sink = ListErrorSink()
+        ser = Evaluator(surface_forms, sink, deduplicate=deduplicate)
+        accumulator = ser.count_errors([PreparedDA.from_line(da) for da in das], sys, keep_instance_results=True)
+        results.append((accumulator.result(), accumulator.instance_results, sink.records))
+    assert results[0] == results[1]
+    # The errors of the duplicates are reported with their own index
+    assert [record.index for record in results[0][2]] == [0, 0, 2, 2]
+
+    assert accumulator.num_evaluated == 5 and accumulator.dedup_ratio == 1
+    accumulator = Evaluator(surface_forms, ErrorSink()).count_errors(das, sys)
+    assert accumulator.num_evaluated == 3 and accumulator.dedup_ratio == 5 / 3
+
+def test_nbest():
+    surface_forms = restaurant_surface_forms()
+    das = ["inform(name='Restaurace A')", "inform(name='Restaurace B')"]
+    nbest_lists = [
+        ["Restaurace B je tady", "Restaurace A je tady", "Restaurace A"],
+        ["Restaurace B", "Restaurace B", "Restaurace A"],
+    ]
+    ser = Evaluator(surface_forms, ErrorSink())
+    nbest_results = ser.evaluate_nbest(das, nbest_lists)
+    assert [[result.slot_errors for result in results] for results in nbest_results] == [[2, 0, 0], [0, 0, 2]]
+    assert nbest_results[0][0] == ser.evaluate_one(das[0], nbest_lists[0][0])
+    # The best hypothesis ranked highest by the decoder is selected
+    assert rerank_nbest(nbest_results) == [1, 0]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        moses_file = os.path.join(tmp_dir, "nbest.moses")
+        with open(moses_file, "w") as fh:
+            for index, hypotheses in enumerate(nbest_lists):
+                for hypothesis in hypotheses:
+                    print(f"{index} ||| {hypothesis} ||| lm=-1.0 ||| -1.0", file=fh)
+        assert read_nbest(moses_file) == nbest_lists
+        text_file = os.path.join(tmp_dir, "nbest.txt")
+        with open(text_file, "w") as fh:
+            for hypotheses in nbest_lists:
+                print("\n".join(hypotheses), file=fh)
+        assert read_nbest(text_file, nbest_size=3) == nbest_lists
+
+        # a DA without hypotheses
+        with open(moses_file, "w") as fh:
+            print("0 ||| Restaurace A", file=fh)
+            print("2 ||| Restaurace B", file=fh)
+        try:
+            read_nbest(moses_file)
+            assert False, "A missing n-best list must fail"
+        except AssertionError as error:
+            assert "DA 1" in str(error)
+
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
 
     test_parse_da()
+    test_parse_da_cached()
     test_evaluator_name()
-    test_evaluator_kids_allowed()
\ No newline at end of file
+    test_evaluator_kids_allowed()
+    test_surface_form_automaton()
+    test_surface_form_variants()
+    test_consumable_sentence()
+    test_kids_negation_scanner()
+    test_evaluator_evaluate_many()
+    test_evaluator_jobs()
+    test_evaluator_evaluate_one()
+    test_error_sinks()
+    test_iter_json()
+    test_evaluator_evaluate_stream()
+    test_significance()
+    test_profiling()
+    test_lexicon()
+    test_server()
+    test_async_evaluator()
+    test_instance_arrays()
+    test_breakdown()
+    test_deduplication()
+    test_nbest()